@@ -1,32 +1,24 @@
 #!python
 
 import sys
-import re
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import proxymetrics
 
 # Here's an example line:
 # request_total{direction="outbound",authority="color.faces.svc.cluster.local",target_addr="10.42.1.10:8000",target_ip="10.42.1.10",target_port="8000",tls="true",server_id="default.faces.serviceaccount.identity.linkerd.cluster.local",dst_control_plane_ns="linkerd",dst_deployment="color-west",dst_namespace="faces",dst_pod="color-west-5f98568cc-t6zt7",dst_pod_template_hash="5f98568cc",dst_service="color",dst_serviceaccount="default",dst_zone="zone-west"} 963
 
-reRequestTotal = re.compile(r"request_total{([^}]+)} (\d+)")
-
 total_color = 0
 total_smiley = 0
 
 metrics = []
 
-for line in sys.stdin:
-    line = line.strip()
-
-    matches = reRequestTotal.match(line)
-
-    if matches:
-        labels = matches.group(1)
-        value = int(matches.group(2))
-
-        tags = {}
-
-        for label in labels.split(","):
-            key, val = label.split("=")
-            tags[key] = val.strip('"')
+for sample in proxymetrics.iter_samples(sys.stdin, prefixes=["request_total"]):
+    if sample.name == "request_total":
+        value = int(sample.value)
+        tags = sample.labels
 
         dst_pod = tags.get("dst_pod", "")
         dst_zone = tags.get("dst_zone", "")
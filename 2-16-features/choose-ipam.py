@@ -4,6 +4,10 @@ import os
 import json
 import yaml
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from cidralloc import AllocationError, network_allocators
+
 config = json.load(sys.stdin)
 
 if (not config or
@@ -17,41 +21,26 @@ v4_ranges = []
 v6_ranges = []
 dual_ranges = []
 
-for config in config[0]['IPAM']['Config']:
-    subnet = config.get('Subnet')
-
-    if not subnet:
-        sys.stderr.write(f"No subnet found in IPAM configuration {config}\n")
-        sys.exit(1)
-
-    address, bits = subnet.split('/')
-    bits = int(bits)
-
-    if address.endswith("::"):
-        # IPv6
-        if bits < 64:
-            sys.stderr.write(f"Subnet {subnet} is too small for IPv6\n")
-            sys.exit(1)
-
-        # Choose two /96 ranges, one for our v6-only cluster and one for
-        # our dualstack cluster.
-        base = address[:-1]
-
-        v6_ranges.append(f"{base}6::/96")
-        dual_ranges.append(f"{base}10::/96")
-    elif address.endswith(".0"):
-        # IPv4
-        if bits < 24:
-            sys.stderr.write(f"Subnet {subnet} is too small for IPv4\n")
-            sys.exit(1)
-
-        base = address[:-1]  # Pull off the 0
-
-        v4_ranges.append(f"{base}64/28")    # 0x40
-        dual_ranges.append(f"{base}160/28")  # 0xA0
-    else:
-        sys.stderr.write(f"Unknown subnet format {subnet}\n")
-        sys.exit(1)
+# Each subnet gets two pools, one for our single-stack cluster and one for
+# our dualstack cluster. They go where they always have (.64/28 and .160/28
+# of an IPv4 subnet, :6::/96 and :10::/96 of an IPv6 one) unless something
+# else on the Docker network is already using those addresses, in which case
+# they go wherever there's room.
+try:
+    allocators = network_allocators(config[0])
+
+    for allocator in allocators:
+        base = allocator.subnet.network_address
+
+        if allocator.subnet.version == 6:
+            v6_ranges.append(str(allocator.allocate(96, at=base + (0x6 << 48))))
+            dual_ranges.append(str(allocator.allocate(96, at=base + (0x10 << 48))))
+        else:
+            v4_ranges.append(str(allocator.allocate(28, at=base + 0x40)))
+            dual_ranges.append(str(allocator.allocate(28, at=base + 0xA0)))
+except AllocationError as e:
+    sys.stderr.write(f"{e}\n")
+    sys.exit(1)
 
 for file, ranges in [
     ( "sma-v4/metallb.yaml", v4_ranges ),
@@ -1,9 +1,35 @@
+import argparse
+import json
 import os
+import re
+import shlex
+import sqlite3
 import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# What we learned from each README last time, so that a rebuild only has to
+# re-read the READMEs that changed. See load_cache().
+CACHE_FILE = ".build-index-cache.json"
+CACHE_VERSION = 3
+
+# Titles and SMA-* fields live at the very top of each README, so that's
+# all we read.
+HEADER_LINES = 50
+HEADER_CHARS = 8192
+
+SMA_FIELDS = ( "SMA-Index", "SMA-Description" )
+
+# What counts as a word for the search index: runs of letters and digits,
+# keeping version numbers like 2.15 in one piece.
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+
 def find_readme_files():
-    subdirectories = [ name for name in os.listdir(".") if os.path.isdir(name) ]
+    # Hidden directories (.git, .pytest_cache...) aren't workshops, even if
+    # they have a README.md.
+    subdirectories = [ name for name in os.listdir(".")
+                       if os.path.isdir(name) and not name.startswith(".") ]
 
     readme_files = []
     for subdir in subdirectories:
@@ -35,13 +61,421 @@ def get_last_modified_date(file_path):
         except OSError:
             return "unknown"
 
-def find_lines_with_prefix(file_path, prefixes):
-    lines = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            if line.startswith(tuple(prefixes)):
-                lines.append(line.strip())
-    return lines
+def get_last_modified_dates(file_paths):
+    """Get the last modified dates of a bunch of files from Git, in one walk
+    over the history: the first commit we see touching a file is its most
+    recent one, so we can stop as soon as we've seen every file. Anything
+    the walk doesn't find (untracked files, or no git at all) falls back to
+    get_last_modified_date, in parallel."""
+    dates = {}
+    wanted = set(file_paths)
+
+    try:
+        proc = subprocess.Popen([
+            'git', '-c', 'core.quotepath=off', 'log',
+            '--format=@%cd', '--date=short', '--name-only', '--'
+        ] + sorted(wanted), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except FileNotFoundError:
+        proc = None
+
+    if proc is not None:
+        date = None
+
+        for line in proc.stdout:
+            line = line.rstrip("\n")
+
+            if line.startswith("@"):
+                date = line[1:]
+            elif line in wanted and line not in dates:
+                dates[line] = date
+
+                if len(dates) == len(wanted):
+                    break
+
+        proc.stdout.close()
+        proc.terminate()
+        proc.wait()
+
+    missing = [ path for path in file_paths if path not in dates ]
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for path, date in zip(missing, executor.map(get_last_modified_date, missing)):
+                dates[path] = date
+
+    return dates
+
+def get_blob_hashes(file_paths):
+    """Get the Git blob hash of each file from the index. Files Git doesn't
+    know about (or all of them, if there's no Git) just don't get one."""
+    try:
+        result = subprocess.run([
+            'git', '-c', 'core.quotepath=off', 'ls-files', '-s', '--'
+        ] + file_paths, capture_output=True, text=True, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {}
+
+    blobs = {}
+
+    for line in result.stdout.splitlines():
+        # <mode> <blob> <stage>\t<path>
+        info, path = line.split("\t", 1)
+        blobs[path] = info.split()[1]
+
+    return blobs
+
+def load_cache():
+    """The cache maps each README's path to its blob hash, size and mtime
+    (so that uncommitted edits count as changes too), and what we parsed out
+    of it: title, SMA-* fields and header problems. Dates aren't cached: they
+    depend on the history, not the content (committing a file that was
+    already staged changes its date but not its blob), so every run gets
+    them fresh from get_last_modified_dates(). If the cache is missing or
+    unreadable, we just start over."""
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict) or (cache.get("version") != CACHE_VERSION):
+        return {}
+
+    return cache.get("files", {})
+
+def save_cache(entries):
+    tmp_file = CACHE_FILE + ".tmp"
+
+    try:
+        with open(tmp_file, "w") as f:
+            json.dump({ "version": CACHE_VERSION, "files": entries }, f, indent=1, sort_keys=True)
+
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError:
+        # Not being able to save the cache just makes the next run slower.
+        pass
+
+def read_header(readme_file):
+    """Read just the header of a README: its SMA-* fields and its title (the
+    first "# " line, which ends the header). We never read more than
+    HEADER_LINES lines or HEADER_CHARS characters looking for it, however
+    long the README is. Returns the title (or None), the SMA-* fields, and a
+    list of anything wrong with them."""
+    title = None
+    fields = {}
+    problems = []
+    budget = HEADER_CHARS
+
+    with open(readme_file, encoding="utf-8", errors="replace") as f:
+        for lineno in range(1, HEADER_LINES + 1):
+            line = f.readline(budget)
+
+            if not line:
+                break
+
+            budget -= len(line)
+
+            if line.startswith("# "):
+                title = line[2:].strip()
+                break
+
+            if not line.startswith("SMA-"):
+                continue
+
+            name, colon, value = line.partition(":")
+            value = value.strip()
+
+            if not colon:
+                problems.append(f"line {lineno}: malformed {name.strip()} header")
+            elif name not in SMA_FIELDS:
+                problems.append(f"line {lineno}: unknown header {name}")
+            elif not value:
+                problems.append(f"line {lineno}: empty {name}")
+            else:
+                if name in fields:
+                    problems.append(f"line {lineno}: duplicate {name}")
+
+                fields[name] = value
+
+    sma_index = fields.get("SMA-Index")
+
+    if sma_index and (sma_index.lower() != "skip"):
+        problems.append(f"unknown SMA-Index value {sma_index}")
+
+    return title, fields, problems
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower()) if text else []
+
+def build_search_index(catalog):
+    """Build an inverted index over the catalog: every token of every title
+    and description maps to the (sorted) numbers of the workshops it shows
+    up in, and each workshop's number picks out its path, title and last
+    updated date, which is all a search results page needs."""
+    tokens = {}
+
+    for number, workshop in enumerate(catalog):
+        for token in tokenize(workshop["title"]) + tokenize(workshop["description"]):
+            numbers = tokens.setdefault(token, [])
+
+            if not numbers or (numbers[-1] != number):
+                numbers.append(number)
+
+    return {
+        "workshops": [ [ workshop["path"], workshop["title"], workshop["updated"] ] for workshop in catalog ],
+        "tokens": dict(sorted(tokens.items())),
+    }
+
+# Fenced code blocks, for --code-blocks: an opening fence (possibly indented,
+# inside a list item) with its info string, and Markdown headings, which
+# name the section each block is in.
+FENCE_RE = re.compile(r"^(\s*)(`{3,}|~{3,})\s*([^`\s]*)")
+HEADING_RE = re.compile(r"^#{1,6}\s+(.*?)\s*#*\s*$")
+# Here-documents start with << but here-strings (<<<) don't, so skip those.
+HEREDOC_RE = re.compile(r"(?<!<)<<(?!<)-?\s*['\"]?(\w+)['\"]?")
+
+# Code blocks in these languages get their commands indexed.
+SHELL_LANGUAGES = ( "bash", "sh", "shell", "console", "zsh" )
+
+# Tokens that separate one command from the next on a shell line.
+SHELL_SEPARATORS = ( "|", "||", "&&", ";", "&", "(", ")" )
+
+# Plenty of READMEs tag a command's output (or some YAML) as bash, so a line
+# without a prompt only counts as a command if it starts with one of these,
+# a ./script or a VAR=value setting.
+SHELL_PROGRAMS = frozenset("""
+    aws az base64 bash bat cat cd chmod cmctl cp curl cut diff docker
+    echo env envsubst export flux for gcloud git grep head helm if ip
+    jq k3d kind kill kubectl kubectx kustomize kyverno less linkerd ls make
+    mkdir more mv open openssl podman printf promtool python python3 read rm
+    sed set sh sleep sort source step tail tar terraform touch tr tree
+    uniq vault vi vim watch wc wget while xargs yq zsh
+""".split())
+
+SHELL_ASSIGNMENT_RE = re.compile(r"^[A-Za-z_]\w*=")
+
+CODE_BLOCKS_VERSION = 2
+
+CODE_BLOCKS_SCHEMA = """
+CREATE TABLE readmes (path TEXT PRIMARY KEY, blob TEXT, size INTEGER, mtime INTEGER);
+CREATE TABLE blocks (workshop TEXT, section TEXT, ordinal INTEGER, language TEXT,
+                     line INTEGER, code TEXT, PRIMARY KEY (workshop, section, ordinal));
+CREATE TABLE commands (workshop TEXT, section TEXT, ordinal INTEGER,
+                       program TEXT, verb TEXT, command TEXT);
+CREATE INDEX commands_by_program ON commands (program, verb);
+CREATE INDEX commands_by_block ON commands (workshop, section, ordinal);
+"""
+
+def read_code_blocks(readme_file):
+    """Pull every fenced code block out of a README, as (section, ordinal,
+    language, line, code) tuples: section is the heading the block is under
+    ("" before the first one), ordinal counts the blocks in that section
+    (sections can share a name, so they share a count too), and line is
+    where the opening fence is."""
+    blocks = []
+    ordinals = {}
+    section = ""
+    block = None
+
+    with open(readme_file, encoding="utf-8", errors="replace") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+
+            if block is None:
+                fence = FENCE_RE.match(line)
+
+                if fence:
+                    block = (len(fence.group(1)), fence.group(2), fence.group(3).lower(), lineno, [])
+                    continue
+
+                heading = HEADING_RE.match(line)
+
+                if heading:
+                    section = heading.group(1)
+
+                continue
+
+            indent, fence, language, start, code = block
+            stripped = line.strip()
+
+            if not stripped.startswith(fence) or stripped.strip(fence[0]):
+                # Dedent by the fence's own indentation, as Markdown does.
+                prefix = len(line) - len(line.lstrip())
+                code.append(line[min(prefix, indent):])
+                continue
+
+            block = None
+            ordinal = ordinals[section] = ordinals.get(section, 0) + 1
+            blocks.append((section, ordinal, language, start, "\n".join(code)))
+
+    if block is not None:
+        # A block that's never closed runs to the end of the README.
+        indent, fence, language, start, code = block
+        ordinal = ordinals[section] = ordinals.get(section, 0) + 1
+        blocks.append((section, ordinal, language, start, "\n".join(code)))
+
+    return blocks
+
+def is_command(line):
+    """Whether a line from a shell code block (without a prompt) looks like
+    a command rather than output: "kubectl get pods" does, but "√ can
+    initialize the client", "kind: Deployment" and "├── README.md" don't."""
+    words = line.split(None, 1)
+
+    if not words:
+        return False
+
+    first = words[0]
+
+    return (first in SHELL_PROGRAMS) or first.startswith("./") or bool(SHELL_ASSIGNMENT_RE.match(first))
+
+def shell_commands(code):
+    """Yield each command line of a shell code block, with continuation
+    lines joined up, prompts and comments dropped, and here-documents (the
+    YAML in a "kubectl apply -f - <<EOF", say) skipped. If any line has a
+    "$ " prompt, only the lines with prompts are commands, and the rest is
+    their output; otherwise a line has to pass is_command() (or have a "# "
+    root prompt in front of something that does)."""
+    prompted = any(line.lstrip().startswith("$ ") for line in code.splitlines())
+    lines = iter(code.splitlines())
+
+    for line in lines:
+        while line.endswith("\\"):
+            line = line[:-1] + " " + next(lines, "").strip()
+
+        line = line.strip()
+
+        if line.startswith("$ "):
+            line = line[2:].strip()
+        elif prompted:
+            continue
+        elif line.startswith("# ") and is_command(line[2:]):
+            line = line[2:].strip()
+        elif not is_command(line):
+            continue
+
+        heredoc = HEREDOC_RE.search(line)
+
+        if heredoc:
+            for body in lines:
+                if body.strip() == heredoc.group(1):
+                    break
+
+        yield line
+
+def command_verb(args):
+    """The first word of args that isn't an option. Options before the verb
+    are taken to have values ("kubectl --context east get pods") unless
+    they're written --option=value."""
+    args = iter(args)
+
+    for word in args:
+        if not word.startswith("-"):
+            return word
+
+        if "=" not in word:
+            next(args, None)
+
+    return ""
+
+def command_words(command):
+    """Yield (program, verb) for each command in a shell command line: the
+    program is the first word (after any VAR=value settings), and the verb
+    comes from command_verb(), so that "linkerd install | kubectl apply -f -"
+    gives ("linkerd", "install") and ("kubectl", "apply")."""
+    try:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        tokens = command.split()
+
+    words = []
+
+    for token in tokens + [ ";" ]:
+        if token not in SHELL_SEPARATORS:
+            words.append(token)
+            continue
+
+        while words and re.match(r"^\w+=", words[0]):
+            words.pop(0)
+
+        if words:
+            yield words[0], command_verb(words[1:])
+
+        words = []
+
+def index_code_blocks(db_path, readme_files, keys):
+    """Bring the code block store at db_path up to date with readme_files,
+    re-reading (in parallel) only the READMEs whose key -- the same blob
+    hash, size and mtime as the header cache uses -- has changed. The store
+    is SQLite, so finding, say, every "kubectl apply" across the workshops
+    is one indexed query:
+
+        SELECT workshop, section, command FROM commands
+         WHERE program = 'kubectl' AND verb = 'apply'"""
+    db = sqlite3.connect(db_path)
+
+    if db.execute("PRAGMA user_version").fetchone()[0] != CODE_BLOCKS_VERSION:
+        for table in [ "readmes", "blocks", "commands" ]:
+            db.execute(f"DROP TABLE IF EXISTS {table}")
+
+        db.executescript(CODE_BLOCKS_SCHEMA)
+        db.execute(f"PRAGMA user_version = {CODE_BLOCKS_VERSION}")
+
+    known = { path: (blob, size, mtime)
+              for path, blob, size, mtime in db.execute("SELECT path, blob, size, mtime FROM readmes") }
+
+    stale = [ readme_file for readme_file in readme_files
+              if known.get(readme_file) != (keys[readme_file]["blob"], keys[readme_file]["size"],
+                                            keys[readme_file]["mtime"]) ]
+    current = set(readme_files)
+    gone = [ path for path in known if path not in current ]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        extracted = list(executor.map(read_code_blocks, stale))
+
+    with db:
+        for readme_file in stale + gone:
+            workshop = os.path.dirname(readme_file)
+            db.execute("DELETE FROM readmes WHERE path = ?", (readme_file,))
+            db.execute("DELETE FROM blocks WHERE workshop = ?", (workshop,))
+            db.execute("DELETE FROM commands WHERE workshop = ?", (workshop,))
+
+        for readme_file, blocks in zip(stale, extracted):
+            workshop = os.path.dirname(readme_file)
+            key = keys[readme_file]
+
+            db.execute("INSERT INTO readmes VALUES (?, ?, ?, ?)",
+                       (readme_file, key["blob"], key["size"], key["mtime"]))
+
+            for section, ordinal, language, line, code in blocks:
+                db.execute("INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                           (workshop, section, ordinal, language, line, code))
+
+                if language not in SHELL_LANGUAGES:
+                    continue
+
+                for command in shell_commands(code):
+                    for program, verb in command_words(command):
+                        db.execute("INSERT INTO commands VALUES (?, ?, ?, ?, ?, ?)",
+                                   (workshop, section, ordinal, program, verb, command))
+
+    db.close()
+
+def write_json(path, data, **kwargs):
+    with open(path, "w") as f:
+        json.dump(data, f, **kwargs)
+        f.write("\n")
+
+parser = argparse.ArgumentParser(description='Build the workshop index for README.md (on stdout)')
+parser.add_argument('--catalog', type=str, default=None,
+                    help='Also write the workshops as a JSON catalog to this file')
+parser.add_argument('--search-index', type=str, default=None,
+                    help='Also write an inverted index of title and description words to this file')
+parser.add_argument('--code-blocks', type=str, default=None,
+                    help='Also extract the fenced code blocks into this SQLite database (updated incrementally)')
+args = parser.parse_args()
 
 output = [
     "# Service Mesh Academy",
@@ -60,31 +494,80 @@ workshops = []
 
 readme_files = find_readme_files()
 
+cache = load_cache()
+blobs = get_blob_hashes(readme_files)
+entries = {}
+keys = {}
+stale = []
+
 for readme_file in readme_files:
-    sma_index = None
-    sma_description = None
-    title = None
+    stat = os.stat(readme_file)
+    key = keys[readme_file] = { "blob": blobs.get(readme_file), "size": stat.st_size, "mtime": stat.st_mtime_ns }
+    entry = cache.get(readme_file)
+
+    if entry and all(entry.get(name) == value for name, value in key.items()):
+        entries[readme_file] = entry
+    else:
+        title, fields, problems = read_header(readme_file)
+        entries[readme_file] = dict(key, title=title, fields=fields, problems=problems)
+        stale.append(readme_file)
 
-    for line in open(readme_file):
-        if line.startswith("# "):
-            title = line[2:].strip()
-            break
+# Get the last modified dates from Git, all at once
+last_modified_dates = get_last_modified_dates(readme_files)
+
+if stale or (len(entries) != len(cache)):
+    save_cache(entries)
+
+for readme_file in readme_files:
+    entry = entries[readme_file]
+    title = entry["title"]
+    sma_index = entry["fields"].get("SMA-Index")
+    sma_description = entry["fields"].get("SMA-Description")
 
-        if line.startswith("SMA-Index: "):
-            sma_index = line[10:].strip()
-        elif line.startswith("SMA-Description: "):
-            sma_description = line[16:].strip()
+    for problem in entry["problems"]:
+        print(f"{readme_file}: {problem}", file=sys.stderr)
 
     if sma_index and (sma_index.lower() == "skip"):
         # print(f"<!-- skip {readme_file} -->")
         continue
 
-    # Get the last modified date from Git
-    last_modified = get_last_modified_date(readme_file)
+    last_modified = last_modified_dates[readme_file]
 
-    workshops.append(f"* [**{title}**]({readme_file}) - {sma_description} *(last updated: {last_modified})*")
+    # Flag missing titles and descriptions rather than putting "None" in the
+    # index: the workshop still gets listed, under its directory name if it
+    # has no title.
+    if not title:
+        print(f"{readme_file}: no title", file=sys.stderr)
+        title = os.path.dirname(readme_file)
+
+    if sma_description:
+        line = f"* [**{title}**]({readme_file}) - {sma_description} *(last updated: {last_modified})*"
+    else:
+        print(f"{readme_file}: no SMA-Description", file=sys.stderr)
+        line = f"* [**{title}**]({readme_file}) *(last updated: {last_modified})*"
+
+    workshops.append((line, {
+        "path": readme_file,
+        "workshop": os.path.dirname(readme_file),
+        "title": title,
+        "description": sma_description,
+        "updated": last_modified,
+    }))
+
+workshops.sort(key=lambda workshop: workshop[0])
 
 print("\n".join(output))
-print("\n".join(sorted(workshops)))
+print("\n".join(line for line, _ in workshops))
+
+catalog = [ workshop for _, workshop in workshops ]
+
+if args.catalog:
+    write_json(args.catalog, { "workshops": catalog }, indent=2)
+
+if args.search_index:
+    write_json(args.search_index, build_search_index(catalog), separators=(",", ":"))
+
+if args.code_blocks:
+    index_code_blocks(args.code_blocks, [ workshop["path"] for workshop in catalog ], keys)
 
 
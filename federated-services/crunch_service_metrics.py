@@ -1,6 +1,17 @@
-import subprocess
+import sys
+
+import argparse
+import os
 import time
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import metricsources
+import rates
+import records
+import screen
 
 RED = "\033[31m"
 GREEN = "\033[32m"
@@ -18,47 +29,36 @@ LABELS_OF_INTEREST = {
     "parent_kind",
 }
 
-def parse_labels(label_str):
-    labels = {}
-
-    for item in label_str.split(','):
-        if '=' in item:
-            k, v = item.split('=', 1)
-            labels[k.strip()] = v.strip().strip('"')
-
-    return labels
+# With --prometheus, Prometheus does the grouping that get_metrics() does,
+# and only the grouped rows come back. Grouping by __name__ keeps the metric
+# name, so we can still tell HTTP from gRPC. Grouping by pod too lets the
+# PrometheusSource stick to one pod, as scraping deploy/face does: summing
+# the raw counters across replicas would both differ from scraping and drop
+# (looking like a counter reset) whenever a replica went away.
+PROMETHEUS_QUERY = '''
+    sum by (__name__, pod, parent_name, parent_port, backend_name) (
+        {
+            __name__=~"outbound_(http|grpc)_route_backend_requests_total",
+            namespace="faces",
+            deployment="face"
+        }
+    )
+'''
 
-def get_metrics(context):
-    try:
-        output = subprocess.check_output(
-            ["linkerd", "--context", context, "diagnostics", "proxy-metrics", \
-                        "-n", "faces", "deploy/face"],
-            text=True
-        )
-    except subprocess.CalledProcessError as e:
-        print("Error running linkerd:", e)
-        return []
+def get_metrics(source):
+    # Note that this raises SourceError if the source fails; the caller
+    # deals with that, since this runs in a worker thread.
+    samples = source.samples(prefixes=METRICS_OF_INTEREST)
 
     metrics = defaultdict(lambda: defaultdict(dict))
 
-    for line in output.splitlines():
-        if line.startswith("#") or not line.strip():
-            continue
-
-        if '{' not in line or '}' not in line:
-            continue
-
-        metric_name, rest = line.split("{", maxsplit=1)
-        label_string, value = rest.split("}", maxsplit=1)
-
-        metric_name = metric_name.strip()
-        value = value.strip()
+    for sample in samples:
+        metric_name = sample.name
+        value = int(sample.value)
 
         if metric_name in METRICS_OF_INTEREST:
             protocol = METRICS_OF_INTEREST[metric_name]
-
-            # Extract labels
-            labels = parse_labels(label_string)
+            labels = sample.labels
 
             name = labels.get("parent_name", "unknown")
             port = labels.get("parent_port", "unknown")
@@ -74,9 +74,9 @@ def get_metrics(context):
             source_metrics = protocol_metrics[full_name]
 
             if full_backend_name in source_metrics:
-                source_metrics[full_backend_name] += int(value)
+                source_metrics[full_backend_name] += value
             else:
-                source_metrics[full_backend_name] = int(value)
+                source_metrics[full_backend_name] = value
 
     return metrics
 
@@ -94,32 +94,223 @@ def print_metrics(metrics, prev_metrics):
 
                 prev_count = prev_for_source.get(backend, 0)
                 current_count = metrics[protocol][source][backend]
-                diff = current_count - prev_count
+                diff = rates.counter_delta(prev_count, current_count)
 
                 if diff != 0:
                     print("    %32s -> %-32s %8d" % (source, backend, diff))
                 else:
                     print("%s    %32s -> %-32s%s" % (GREY, source, backend, RESET))
 
-def main():
-    prev_metrics = defaultdict(lambda: defaultdict(dict))
+def metrics_record(metrics, prev_metrics, elapsed):
+    """The numbers print_metrics shows, as a dict for --ndjson: per
+    protocol, parent and backend, the current count, the delta since the
+    last good poll and the rate per second. Deltas and rates are None for
+    backends we haven't seen before."""
+
+    record = {}
+
+    for protocol in sorted(metrics.keys()):
+        record[protocol] = {}
+
+        for source in sorted(metrics[protocol].keys()):
+            prev_for_source = prev_metrics.get(protocol, {}).get(source, {})
+            backends = {}
+
+            for backend in sorted(metrics[protocol][source].keys()):
+                count = metrics[protocol][source][backend]
+
+                if backend not in prev_for_source:
+                    backends[backend] = { "count": count, "delta": None, "rate": None }
+                    continue
+
+                diff = rates.counter_delta(prev_for_source[backend], count)
+
+                backends[backend] = {
+                    "count": count,
+                    "delta": diff,
+                    "rate": diff / elapsed if elapsed else None,
+                }
+
+            record[protocol][source] = backends
+
+    return record
+
+# One context's metrics, when they were scraped, and whether they're the
+# answer to an earlier poll's request that timed out.
+Scrape = namedtuple("Scrape", ["metrics", "time", "late"])
+
+class ClusterPoller:
+    """Collect metrics from every context at once, so a refresh takes about
+    as long as the slowest cluster instead of the sum of all of them. A
+    context that doesn't answer within the timeout is reported as stale
+    rather than holding up everyone else.
+
+    A context that answers after its timeout still gets its answer used on
+    a later poll, but labeled with when that scrape actually happened (and
+    as late), so that its delta is charged to the right interval."""
+
+    def __init__(self, sources, timeout):
+        self.sources = sources
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=len(sources))
+        self.polls = 0
+
+        # For each context, the request in flight and the poll that made it.
+        self.pending = {}
 
-    while True:
-        current_metrics = {
-            "east": get_metrics("east"),
-            "west": get_metrics("west"),
+    @staticmethod
+    def scrape(source):
+        metrics = get_metrics(source)
+        return Scrape(metrics, source.now(), False)
+
+    def poll(self):
+        """Returns a Scrape for every context that answered, and an error
+        for every one that didn't."""
+
+        self.polls += 1
+
+        # Don't pile up a second request on a context that's still working
+        # on the last one -- it's just going to be stale again.
+        for context, source in self.sources.items():
+            if context not in self.pending:
+                self.pending[context] = (self.executor.submit(self.scrape, source), self.polls)
+
+        deadline = time.monotonic() + self.timeout
+        results = {}
+        errors = {}
+
+        for context in self.sources.keys():
+            future, submitted = self.pending[context]
+
+            try:
+                result = future.result(timeout=max(0, deadline - time.monotonic()))
+                results[context] = result._replace(late=(submitted != self.polls))
+            except TimeoutError:
+                errors[context] = f"no response in {self.timeout}s"
+                continue
+            except metricsources.SourceError as e:
+                errors[context] = str(e)
+
+            del self.pending[context]
+
+        return results, errors
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch federated Service traffic')
+    parser.add_argument('--timeout', type=float, default=4.0,
+                        help='Seconds to wait for each context before marking it stale')
+    parser.add_argument('--interval', type=float, default=5.0,
+                        help='Seconds between refreshes')
+    metricsources.add_source_arguments(parser)
+    parser.add_argument('--prometheus', type=str, default=None,
+                        help='Query the Prometheus at this URL ({context} is filled in) instead of scraping the proxies')
+    screen.add_screen_arguments(parser)
+    records.add_record_arguments(parser)
+    parser.add_argument('contexts', nargs='*', default=[ "east", "west" ],
+                        help='Kubernetes contexts to watch (default: east west)')
+    args = parser.parse_args()
+
+    if args.prometheus:
+        sources = {
+            context: metricsources.PrometheusSource(args.prometheus.format(context=context),
+                                                    PROMETHEUS_QUERY, timeout=args.timeout,
+                                                    pin="pod")
+            for context in args.contexts
+        }
+    else:
+        sources = {
+            context: metricsources.make_source(args.source, "faces", "deploy/face",
+                                               context=context, url=args.url,
+                                               timeout=args.timeout,
+                                               record=args.record, replay=args.replay)
+            for context in args.contexts
         }
 
-        subprocess.run("clear")
-        print(time.strftime("%Y-%m-%d %H:%M:%S"))
+    poller = ClusterPoller(sources, args.timeout)
+    prev_metrics = {}
+    prev_times = {}
+    stale_since = {}
+
+    if args.ndjson:
+        display = records.RecordWriter(args.ndjson_buffer, args.ndjson_when_full)
+    else:
+        display = screen.make_screen(args.screen)
+
+    try:
+        while True:
+            scrapes, errors = poller.poll()
+            current_metrics = { context: scrape.metrics for context, scrape in scrapes.items() }
+
+            if args.ndjson:
+                contexts = {}
+
+                for context in args.contexts:
+                    if context in errors:
+                        since = stale_since.setdefault(context, time.strftime("%H:%M:%S"))
+                        contexts[context] = { "stale_since": since, "error": errors[context] }
+                        continue
+
+                    stale_since.pop(context, None)
+
+                    now = scrapes[context].time
+                    prev_time = prev_times.get(context)
+                    elapsed = (now - prev_time) if prev_time is not None else None
+
+                    contexts[context] = {
+                        "elapsed": elapsed,
+                        "late": scrapes[context].late,
+                        "protocols": metrics_record(current_metrics[context],
+                                                    prev_metrics.get(context, {}),
+                                                    elapsed),
+                    }
+
+                    prev_metrics[context] = current_metrics[context]
+                    prev_times[context] = now
+
+                display.emit({ "time": time.time(), "contexts": contexts })
+
+                time.sleep(args.interval)
+                continue
+
+            with display.frame():
+                print(time.strftime("%Y-%m-%d %H:%M:%S"))
+
+                for i, context in enumerate(args.contexts):
+                    header = f"{context.upper()}:"
+
+                    if i > 0:
+                        header = "\n" + header
+
+                    if context in errors:
+                        # Keep the last good metrics around, so the next good poll
+                        # still has something to diff against.
+                        since = stale_since.setdefault(context, time.strftime("%H:%M:%S"))
+                        print(f"{header} {RED}(stale since {since}: {errors[context]}){RESET}")
+                        continue
+
+                    stale_since.pop(context, None)
+
+                    if scrapes[context].late:
+                        header += f" {GREY}(late){RESET}"
+
+                    print(header)
+                    print_metrics(current_metrics[context], prev_metrics.get(context, {}))
+
+                    prev_metrics[context] = current_metrics[context]
 
-        print("EAST:")
-        print_metrics(current_metrics["east"], prev_metrics["east"])
-        print("\nWEST:")
-        print_metrics(current_metrics["west"], prev_metrics["west"])
+            time.sleep(args.interval)
+    except (metricsources.EndOfRecording, BrokenPipeError):
+        pass
+    finally:
+        display.close()
+        poller.close()
 
-        prev_metrics = current_metrics
-        time.sleep(5)
+        # Don't leave kubectl port-forwards behind.
+        for source in sources.values():
+            source.close()
 
 if __name__ == "__main__":
     main()
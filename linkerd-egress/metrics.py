@@ -2,143 +2,228 @@
 
 import sys
 
-import subprocess
+import argparse
 import os
+import re
 import time
 
-def collect_metrics():
-    command = ["linkerd", "dg", "proxy-metrics", "-n", "faces", "deploy/face"]
-    result = subprocess.run(command, capture_output=True, text=True)
-    lines = result.stdout.splitlines()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
 
-    print(len(lines))
+import histograms
+import metricsources
+import proxymetrics
+import rates
+import records
+import screen
+
+METRICS_OF_INTEREST = {
+    "outbound_http_route_request_statuses_total": "HTTP",
+    "outbound_grpc_route_request_statuses_total": "GRPC",
+}
+
+LATENCY_METRIC = "response_latency_ms_bucket"
+
+# The in-cluster suffix of a service's name, as in an authority like
+# smiley.faces.svc.cluster.local:80.
+SERVICE_SUFFIX = re.compile(r"\.[^.]+\.svc\.cluster\.local\.?$")
+
+def host_key(name):
+    """Latency is labeled with the authority, and routes with the hostname:
+    reduce either to the bare host (no port, no .<ns>.svc.cluster.local)
+    so that they meet."""
+
+    return SERVICE_SUFFIX.sub("", name.split(":")[0])
+
+def collect_metrics(source):
+    # If the fetch fails, we return the error along with no metrics, and
+    # show() puts it on the screen with everything else.
+    error = None
+
+    try:
+        lines = source.fetch().splitlines()
+    except metricsources.SourceError as e:
+        error = e
+        lines = []
 
     http_metrics = []
     grpc_metrics = []
+    latency_buckets = {}
 
-    for line in lines:
-        if line.startswith("outbound_http_route_request_statuses_total"):
-            metrics = parse_metrics(line)
-            metrics["metric_type"] = "HTTP"
-            http_metrics.append(metrics)
-        elif line.startswith("outbound_grpc_route_request_statuses_total"):
-            metrics = parse_metrics(line)
-            metrics["metric_type"] = "GRPC"
-            grpc_metrics.append(metrics)
+    for sample in proxymetrics.iter_samples(lines, prefixes=list(METRICS_OF_INTEREST) + [ LATENCY_METRIC ]):
+        if sample.name == LATENCY_METRIC:
+            # Outbound latency by destination host (summed over status
+            # codes), to go with each hostname's routes.
+            if sample.labels.get("direction", "") != "outbound":
+                continue
 
-    return http_metrics, grpc_metrics
+            host = host_key(sample.labels.get("authority", ""))
+            buckets = latency_buckets.setdefault(host, {})
+            bound = histograms.bucket_bound(sample.labels)
+            buckets[bound] = buckets.get(bound, 0) + sample.value
+            continue
 
+        metric_type = METRICS_OF_INTEREST.get(sample.name)
 
-def parse_metrics(line):
-    metrics = {}
+        if metric_type is None:
+            continue
 
-    count = int(line.split()[-1])
-    metrics["count"] = count
+        metrics = parse_metrics(sample)
+        metrics["metric_type"] = metric_type
 
-    parts = line.strip().split("{", 1)[1].rsplit("}", 1)[0].split(",")
+        if metric_type == "HTTP":
+            http_metrics.append(metrics)
+        else:
+            grpc_metrics.append(metrics)
 
-    for part in parts:
-        key, value = part.split("=")
-        metrics[key] = value.strip('"').strip()
+    return http_metrics, grpc_metrics, latency_buckets, error
 
-    return metrics
 
-counts = {}
-last = {}
-lastavg = {}
+def parse_metrics(sample):
+    metrics = dict(sample.labels)
+    metrics["count"] = int(sample.value)
 
-def output(dest, route, count, time_per_sample):
-    output_line = f"\033[90m---.--  {dest} {route}\033[0m"
+    return metrics
 
-    key = f"{dest} {route}"
+def describe(metric):
+    """The destination and route strings we show (and key rates by) for one
+    metric."""
 
-    if key not in last:
-        last[key] = count
+    error = metric["error"]
+    errstr = f" ({error})" if error else ""
+
+    if metric["metric_type"] == "HTTP":
+        dest = f"HTTP: {metric['hostname']} {metric['http_status']}"
     else:
-        # We have a last value. Put the delta between this value and the last
-        # value in counts.
+        dest = f"gRPC: {metric['hostname']} {metric['grpc_status']}"
+
+    route = f"{metric['route_name']} {metric['parent_port']}{errstr}"
 
-        if key not in counts:
-            counts[key] = []
+    return dest, route
 
-        counts[key].append(count - last[key])
-        last[key] = count
+def latency_columns(hostname):
+    return " ".join(histograms.format_latency(value)
+                    for value in latency.quantiles(host_key(hostname)))
 
-        while len(counts[key]) > 10:
-            counts[key].pop(0)
+def output(dest, route, count, now, hostname):
+    lat = latency_columns(hostname)
+    output_line = f"\033[90m---.-- {lat}  {dest} {route}\033[0m"
+
+    key = f"{dest} {route}"
 
-        average = sum(counts[key]) / float(len(counts[key]) * time_per_sample)
-        lastavg[key] = average
+    # windows gives us the rate over the last few samples, or None if this
+    # is the first time we've seen this key.
+    average = windows.update(key, count, now)
 
+    if average is not None:
         color = "\033[90m"
 
-        output_line = f"{color} 0.00/s {dest} via {route}\033[0m"
+        output_line = f"{color} 0.00/s {lat} {dest} via {route}\033[0m"
 
-        if (key not in lastavg) or (average > 0.01):
+        if average > 0.01:
             if not (("OK" in key) or ("200" in key)):
                 color = "\033[91m"
             else:
                 color = "\033[92m"
 
-            output_line = f"{average:5.2f}/s {color}{dest}\033[0m via {route}"
+            output_line = f"{average:5.2f}/s {lat} {color}{dest}\033[0m via {route}"
 
     print(output_line)
-    # print(f"count:   {count}")
-    # print(f"counts:  {counts.get(key, [])}")
-    # print(f"last:    {last[key]}")
-    # print(f"avg:     ---.--")
-    # print(f"lastavg: {lastavg.get(key, '---.--')}")
 
-time_per_sample = 5
+parser = argparse.ArgumentParser(description='Watch egress traffic')
+parser.add_argument('--context', type=str, default=None, help='Kubernetes context')
+parser.add_argument('--window', type=int, default=10,
+                    help='Number of samples to average rates over')
+parser.add_argument('--evict-after', type=int, default=60,
+                    help='Forget series not seen for this many samples')
+parser.add_argument('--interval', type=float, default=5.0,
+                    help='Seconds between refreshes')
+metricsources.add_source_arguments(parser)
+screen.add_screen_arguments(parser)
+records.add_record_arguments(parser)
+args = parser.parse_args()
+
+windows = rates.SeriesWindows(window=args.window, evict_after=args.evict_after)
+latency = histograms.HistogramWindows(window=args.window, evict_after=args.evict_after)
+
+source = metricsources.make_source(args.source, "faces", "deploy/face",
+                                   context=args.context, url=args.url,
+                                   record=args.record, replay=args.replay)
+
+if args.ndjson:
+    display = records.RecordWriter(args.ndjson_buffer, args.ndjson_when_full)
+else:
+    display = screen.make_screen(args.screen)
+
+def show(http_metrics, grpc_metrics, now, error):
+    print(time.strftime("%a %b %d %H:%M:%S %Z %Y"))
+
+    if error:
+        print(f"\033[91m{error}\033[0m")
 
-while True:
-    http_metrics, grpc_metrics = collect_metrics()
-
-    os.system("clear")
-    os.system("date")
     print()
+    print("\033[90m   rate   p50   p95   p99 (ms)\033[0m")
 
     metric_count = 0
 
-    for metric in http_metrics:
-        count = metric["count"]
-        hostname = metric["hostname"]
-        http_status = metric["http_status"]
-        route_name = metric["route_name"]
-        parent_port = metric["parent_port"]
-        error = metric["error"]
-
-        errstr = f" ({error})" if error else ""
-
-        dest = f"HTTP: {hostname} {http_status}"
-        route = f"{route_name} {parent_port}{errstr}"
-
-        metric_count += 1
-        output(dest, route, count, time_per_sample)
-        # break
-
-    for metric in grpc_metrics:
-        count = metric["count"]
-        hostname = metric["hostname"]
-        grpc_status = metric["grpc_status"]
-        route_name = metric["route_name"]
-        parent_port = metric["parent_port"]
-        error = metric["error"]
-
-        errstr = f" ({error})" if error else ""
-
-        dest = f"gRPC: {hostname} {grpc_status}"
-        route = f"{route_name} {parent_port}{errstr}"
+    for metric in http_metrics + grpc_metrics:
+        dest, route = describe(metric)
 
         metric_count += 1
-        output(dest, route, count, time_per_sample)
+        output(dest, route, metric["count"], now, metric["hostname"])
         # break
 
-    if metric_count == 0:
+    if (metric_count == 0) and not error:
         print("No egress metrics found.")
 
-    time.sleep(time_per_sample)
-    # _ = sys.stdin.readline()
+def record(http_metrics, grpc_metrics, now, error):
+    routes = []
+
+    for metric in http_metrics + grpc_metrics:
+        dest, route = describe(metric)
+        key = f"{dest} {route}"
+
+        routes.append({
+            "protocol": metric["metric_type"],
+            "hostname": metric["hostname"],
+            "status": metric.get("http_status", metric.get("grpc_status")),
+            "route": metric["route_name"],
+            "port": metric["parent_port"],
+            "error": metric["error"],
+            "count": metric["count"],
+            "rate": windows.update(key, metric["count"], now),
+            "delta": windows.delta(key),
+            "latency": dict(zip([ "p50", "p95", "p99" ], latency.quantiles(host_key(metric["hostname"])))),
+        })
+
+    return { "time": time.time(), "error": str(error) if error else None, "routes": routes }
+
+try:
+    while True:
+        http_metrics, grpc_metrics, latency_buckets, error = collect_metrics(source)
+        now = source.now()
+
+        for host, buckets in latency_buckets.items():
+            latency.update(host, [ host ], buckets)
+
+        latency.advance()
+
+        if args.ndjson:
+            display.emit(record(http_metrics, grpc_metrics, now, error))
+        else:
+            with display.frame():
+                show(http_metrics, grpc_metrics, now, error)
+
+        windows.advance()
+
+        time.sleep(args.interval)
+        # _ = sys.stdin.readline()
+except (metricsources.EndOfRecording, BrokenPipeError):
+    pass
+finally:
+    display.close()
+
+    # Don't leave a kubectl port-forward behind.
+    source.close()
 
 # # HELP outbound_http_route_request_statuses Completed request-response streams.
 # # TYPE outbound_http_route_request_statuses counter
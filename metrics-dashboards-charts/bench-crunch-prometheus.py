@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Check that crunch_service_metrics.py --prometheus shows the same numbers
+# as scraping the proxies directly, and see how much less data it moves.
+# A fake Prometheus serves synthetic dumps (from tools/genmetrics.py) for
+# a few replicas of deploy/face, evaluating PROMETHEUS_QUERY over them the
+# way a real one would; each tick, the script's get_metrics() runs against
+# both it and a direct scrape of the pod the Prometheus source is pinned
+# to, and the two must match. On the last tick the pinned replica goes
+# away, so the source has to move to another one, as a port-forward would.
+#
+# python bench-crunch-prometheus.py [--series 20000] [--replicas 3] [--ticks 5]
+
+import sys
+
+import argparse
+import json
+import os
+import re
+import threading
+import urllib.parse
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "tools"))
+sys.path.insert(0, os.path.join(HERE, "..", "federated-services"))
+
+import crunch_service_metrics
+import genmetrics
+import metricsources
+import proxymetrics
+
+
+class FakePrometheus:
+    """Just enough PromQL for PROMETHEUS_QUERY: a sum by some labels of the
+    series matching a __name__ regex and some label equalities."""
+
+    def __init__(self):
+        self.pods = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def load(self, dumps):
+        self.pods = {
+            pod: [ (sample.name, dict(sample.labels, namespace="faces", deployment="face", pod=pod), sample.value)
+                   for sample in proxymetrics.iter_samples(text.splitlines()) ]
+            for pod, text in dumps.items()
+        }
+
+    def evaluate(self, query):
+        by = [ label.strip() for label in re.search(r"sum by \(([^)]*)\)", query).group(1).split(",") ]
+        name_re = re.compile(re.search(r'__name__=~"([^"]*)"', query).group(1))
+        matchers = re.findall(r'(\w+)="([^"]*)"', query)
+        sums = defaultdict(float)
+
+        for samples in self.pods.values():
+            for name, labels, value in samples:
+                if not name_re.fullmatch(name):
+                    continue
+
+                if any(labels.get(label) != wanted for label, wanted in matchers):
+                    continue
+
+                labels = dict(labels, __name__=name)
+                sums[tuple((label, labels.get(label, "")) for label in by)] += value
+
+        return [ { "metric": dict(key), "value": [ 0, str(value) ] } for key, value in sums.items() ]
+
+    def serve(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = dict(re.findall(r"([^?&=]+)=([^&]*)", self.path))
+                body = json.dumps({
+                    "status": "success",
+                    "data": {
+                        "resultType": "vector",
+                        "result": fake.evaluate(urllib.parse.unquote_plus(query["query"])),
+                    },
+                }).encode("utf-8")
+
+                with fake.lock:
+                    fake.bytes += len(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+
+class DumpSource(metricsources.Source):
+    """A direct scrape of one pod, from its dump."""
+
+    def __init__(self):
+        self.text = ""
+        self.bytes = 0
+
+    def fetch(self):
+        self.bytes += len(self.text)
+        return self.text
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check crunch_service_metrics.py --prometheus against direct scraping')
+    parser.add_argument('--series', type=int, default=20000, help='Series per proxy dump')
+    parser.add_argument('--replicas', type=int, default=3, help='Replicas of deploy/face')
+    parser.add_argument('--ticks', type=int, default=5, help='Polls to compare')
+    args = parser.parse_args()
+
+    pods = [ f"face-5f98568cc-{i:05x}" for i in range(args.replicas) ]
+    seeds = { pod: seed for seed, pod in enumerate(pods, 1) }
+
+    fake = FakePrometheus()
+    server = fake.serve()
+    prometheus = metricsources.PrometheusSource(f"http://127.0.0.1:{server.server_port}",
+                                                crunch_service_metrics.PROMETHEUS_QUERY,
+                                                pin="pod")
+    direct = DumpSource()
+    mismatches = 0
+
+    for tick in range(args.ticks):
+        if (tick == args.ticks - 1) and (len(pods) > 1):
+            # The replica we're pinned to goes away.
+            pods = pods[1:]
+
+        dumps = { pod: "\n".join(genmetrics.generate(series=args.series, tick=tick, seed=seeds[pod])) + "\n"
+                  for pod in pods }
+
+        fake.load(dumps)
+        from_prometheus = crunch_service_metrics.get_metrics(prometheus)
+
+        direct.text = dumps[prometheus.pinned]
+        from_direct = crunch_service_metrics.get_metrics(direct)
+
+        same = json.dumps(from_prometheus, sort_keys=True) == json.dumps(from_direct, sort_keys=True)
+        print("tick %d: pinned to %s, %s" % (tick, prometheus.pinned, "same" if same else "DIFFERENT"))
+
+        if not same:
+            mismatches += 1
+
+    print("direct scraping:     %10d bytes/poll" % (direct.bytes / args.ticks))
+    print("Prometheus query:    %10d bytes/poll" % (fake.bytes / args.ticks))
+
+    server.shutdown()
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Benchmark promq.py's query modes against a fake Prometheus, so we can see
+# how much work each one makes Prometheus do without needing a cluster. The
+# fake charges a fixed evaluation cost for every rate() in a query, which is
+# roughly how a real Prometheus' load scales for these queries.
+#
+# python bench-promq.py [ticks]
+
+import sys
+
+import json
+import threading
+import time
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import promq
+
+# Seconds of "evaluation" per rate() in a query.
+RATE_COST = 0.002
+
+STATUSES = {
+    "OK": 95.0,
+    "UNKNOWN": 3.0,
+    "UNAVAILABLE": 2.0,
+}
+
+
+class FakePrometheus:
+    def __init__(self):
+        self.requests = 0
+        self.rate_evaluations = 0
+        self.points = 0
+        self.lock = threading.Lock()
+
+        # A fixed timestamp, aligned to 10s like a real [10s:10s] subquery
+        # would be, so that runs never straddle a step boundary.
+        self.timestamp = int(time.time()) // 10 * 10
+
+    def evaluate_range(self, query, start, end, step):
+        labels = { "parent_name": "voting-svc", "parent_namespace": "emojivoto" }
+        values = []
+        ts = start
+
+        while ts <= end:
+            values.append([ ts, str(ts % 97) ])
+            ts += step
+
+        with self.lock:
+            self.requests += 1
+            self.points += len(values)
+
+        return [ { "metric": labels, "values": values } ]
+
+    def evaluate(self, query):
+        rates = query.count("rate(")
+
+        with self.lock:
+            self.requests += 1
+            self.rate_evaluations += rates
+
+        time.sleep(rates * RATE_COST)
+
+        labels = { "parent_name": "voting-svc", "parent_namespace": "emojivoto" }
+
+        if "grpc_status) (" in query:
+            values = [ (dict(labels, grpc_status=status), rate)
+                       for status, rate in STATUSES.items() ]
+        elif "/" in query:
+            values = [ (labels, STATUSES["OK"] / sum(STATUSES.values())) ]
+        elif 'grpc_status="OK"' in query:
+            values = [ (labels, STATUSES["OK"]) ]
+        else:
+            values = [ (labels, sum(STATUSES.values())) ]
+
+        return [ { "metric": metric, "values": [ [ self.timestamp, str(value) ] ] }
+                 for metric, value in values ]
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Headers and body go out in separate writes; without TCP_NODELAY,
+        # Nagle and delayed ACKs add ~40ms to every kept-alive request.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = urllib.parse.parse_qs(url.query)
+            query = params.get("query", [""])[0]
+
+            if url.path == "/api/v1/query_range":
+                result = fake.evaluate_range(query, float(params["start"][0]),
+                                             float(params["end"][0]),
+                                             float(params["step"][0]))
+            else:
+                result = fake.evaluate(query)
+
+            body = json.dumps({
+                "status": "success",
+                "data": {
+                    "resultType": "matrix",
+                    "result": result,
+                },
+            }).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    fake = FakePrometheus()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    promq.PROMETHEUS_URL = f"http://127.0.0.1:{server.server_port}"
+
+    total = promq.PrometheusQuery('sum by (parent_name, parent_namespace) (rate(x[1m]))[10s:10s]')
+    success = promq.PrometheusQuery('sum by (parent_name, parent_namespace) (rate(x{grpc_status="OK"}[1m]))[10s:10s]')
+    rate = promq.PrometheusQuery('(sum by (parent_name, parent_namespace) (rate(x{grpc_status="OK"}[1m])) / sum by (parent_name, parent_namespace) (rate(x[1m])))[10s:10s]')
+    by_status = promq.PrometheusQuery('sum by (parent_name, parent_namespace, grpc_status) (rate(x[1m]))[10s:10s]')
+
+    queries = { "total": total, "success": success, "rate": rate }
+
+    derivations = {
+        "total": promq.sum_where(),
+        "success": promq.sum_where(grpc_status="OK"),
+        "rate": promq.ratio(promq.sum_where(grpc_status="OK"), promq.sum_where()),
+    }
+
+    # A dashboard with lots of panels, to see fan-out at work.
+    panels = { f"panel{i}": promq.PrometheusQuery(total.query) for i in range(30) }
+    panels["rate"] = rate
+
+    executor = ThreadPoolExecutor(max_workers=32)
+
+    modes = [
+        ( "separate", lambda: promq.get_one_row(queries) ),
+        ( "batched", lambda: promq.get_one_row_batched(by_status, derivations) ),
+        ( "concurrent", lambda: promq.get_one_row(queries, executor) ),
+        ( "30 panels", lambda: promq.get_one_row(panels) ),
+        ( "30 fan-out", lambda: promq.get_one_row(panels, executor) ),
+    ]
+
+    for name, run in modes:
+        fake.requests = 0
+        fake.rate_evaluations = 0
+
+        start = time.perf_counter()
+
+        for i in range(ticks):
+            _, values = run()
+
+        elapsed = time.perf_counter() - start
+
+        print("%-10s %4d ticks in %6.3fs: %4d requests, %4d rate() evaluations  (rate %.4f)" %
+              (name, ticks, elapsed, fake.requests, fake.rate_evaluations, values["rate"]))
+
+    # An hour-long window at 10s steps, refreshed once per step, with and
+    # without the range cache.
+    for name, cache_for_tick in [
+        ( "uncached", lambda cache: promq.RangeCache() ),
+        ( "cached", lambda cache: cache ),
+    ]:
+        fake.requests = 0
+        fake.points = 0
+
+        cache = promq.RangeCache()
+        end = fake.timestamp
+        start = time.perf_counter()
+
+        for i in range(ticks):
+            result = cache_for_tick(cache).get(total.query, end - 3600, end, 10)
+            end += 10
+
+        elapsed = time.perf_counter() - start
+
+        print("%-10s %4d ticks in %6.3fs: %4d requests, %6d points transferred (%d points in window)" %
+              (name, ticks, elapsed, fake.requests, fake.points, len(result[0]["values"])))
+
+    server.shutdown()
+
+    # Post-processing a big matrix result: summing 1000 series x 1000 steps
+    # by one label, starting from the response text. The plain way decodes
+    # it with json.loads and adds up one float() at a time; columnar parses
+    # it with ColumnarResult.from_json and sums whole arrays.
+    result = [ { "metric": { "pod": f"pod-{i}", "zone": f"zone-{i % 3}" },
+                 "values": [ [ ts, str(ts % 97) ] for ts in range(1000) ] }
+               for i in range(1000) ]
+    text = json.dumps({ "status": "success", "data": { "resultType": "matrix", "result": result } })
+
+    start = time.perf_counter()
+    result = promq.result_of(json.loads(text))
+    decoded = time.perf_counter()
+    sums = {}
+
+    for entry in result:
+        zone = entry["metric"]["zone"]
+        zone_sums = sums.setdefault(zone, {})
+
+        for ts, value in entry["values"]:
+            zone_sums[ts] = zone_sums.get(ts, 0.0) + float(value)
+
+    done = time.perf_counter()
+
+    print("%-10s sum by zone in %6.3fs (%.3fs decoding, %.3fs summing)" %
+          ("python", done - start, decoded - start, done - decoded))
+
+    if promq.numpy is None:
+        print("columnar   skipped (no NumPy)")
+    else:
+        # Decoding is a one-time cost; after that, every aggregation works on
+        # whole arrays.
+        start = time.perf_counter()
+        columnar = promq.ColumnarResult.from_json(text)
+        decoded = time.perf_counter()
+        columnar.sum_by("zone")
+        done = time.perf_counter()
+
+        print("%-10s sum by zone in %6.3fs (%.3fs decoding, %.3fs summing)" %
+              ("columnar", done - start, decoded - start, done - decoded))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
 import sys
 
-import re
-import subprocess
+import argparse
+import os
 import time
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import histograms
+import metricsources
+import proxymetrics
+import rates
+import records
+import screen
 
 RED = "\033[31m"
 GREEN = "\033[32m"
@@ -20,10 +30,9 @@ interesting_metrics = [
     "outbound_http_balancer_adaptive_load_average",
     "outbound_http_balancer_adaptive_load_band_low",
     "outbound_http_balancer_adaptive_load_band_high",
+    "response_latency_ms_bucket",
 ]
 
-reInterestingMetric = re.compile(r"(" + "|".join(interesting_metrics) + r"){([^}]+)} (\d+(\.\d+)?)$")
-
 
 class Load:
     def __init__(self, average, low, high):
@@ -51,44 +60,38 @@ class Load:
             self.high / scalar if self.high is not None else None,
         )
 
-def parse_labels(label_str):
-    labels = {}
-
-    for item in label_str.split(','):
-        if '=' in item:
-            k, v = item.split('=', 1)
-            labels[k.strip()] = v.strip().strip('"')
-
-    return labels
-
-def get_metrics(context=None):
-    try:
-        cmd = [ "linkerd" ]
+def workload_of(dst_pod, dst_zone):
+    if dst_pod and dst_zone:
+        if dst_pod.startswith("color-"):
+            return "color"
+        elif dst_pod.startswith("smiley-"):
+            return "smiley"
 
-        if context:
-            cmd.extend(["--context", context])
+    return "unknown"
 
-        cmd.extend(["diagnostics", "proxy-metrics", "-n", "faces", "deploy/face"])
-        output = subprocess.check_output(cmd, text=True)
-    except subprocess.CalledProcessError as e:
-        print("Error running linkerd:", e)
-        return []
+def get_metrics(source, stats=None, latency=None):
+    # Note that this raises SourceError if the source fails; the caller
+    # deals with that, since this runs in a worker thread.
+    #
+    # If latency is given, it's filled in with the latency histogram for
+    # each destination pod: { (workload, zone, pod): { bound: count } }.
+    output = source.fetch()
 
     metrics = defaultdict(lambda: defaultdict(dict))
 
-    for line in output.splitlines():
-        if line.startswith("#") or not line.strip():
-            continue
+    # Only families we care about get parsed at all; a busy proxy exports
+    # tens of thousands of series, and nearly all of them get thrown away.
+    samples = proxymetrics.iter_samples(output.splitlines(),
+                                        prefixes=interesting_metrics,
+                                        stats=stats)
 
-        matches = reInterestingMetric.match(line)
+    for sample in samples:
+        metric_name = sample.name
+        labels = sample.labels
 
-        if not matches:
+        if metric_name not in interesting_metrics:
             continue
 
-        metric_name, label_string, value_string, _ = matches.groups()
-        metric_name = metric_name.strip()
-        labels = parse_labels(label_string)
-
         if metric_name == "request_total":
             # Traffic stats and routing info
             direction = labels.get("direction", "")
@@ -100,19 +103,13 @@ def get_metrics(context=None):
             dst_pod = labels.get("dst_pod", "")
             dst_zone = labels.get("dst_zone", "")
 
-            workload = "unknown"
-
-            if dst_pod and dst_zone:
-                if dst_pod.startswith("color-"):
-                    workload = "color"
-                elif dst_pod.startswith("smiley-"):
-                    workload = "smiley"
+            workload = workload_of(dst_pod, dst_zone)
 
             workload_metrics = metrics[workload]
             zone_metrics = workload_metrics[dst_zone]
             total_metrics = workload_metrics["total"]
 
-            value = int(value_string.strip())
+            value = int(sample.value)
 
             # Kludge
             if "total" not in total_metrics:
@@ -124,9 +121,22 @@ def get_metrics(context=None):
                 zone_metrics[dst_pod] = 0
 
             zone_metrics[dst_pod] += value
+        elif metric_name == "response_latency_ms_bucket":
+            # Latency, for the same requests as request_total. There's a
+            # series per status code, so add those up.
+            if (latency is None) or (labels.get("direction", "") != "outbound") or \
+               (not labels.get("tls", "")):
+                continue
+
+            dst_pod = labels.get("dst_pod", "")
+            dst_zone = labels.get("dst_zone", "")
+
+            buckets = latency.setdefault((workload_of(dst_pod, dst_zone), dst_zone, dst_pod), {})
+            bound = histograms.bucket_bound(labels)
+            buckets[bound] = buckets.get(bound, 0) + sample.value
         else:
             # print(line)
-            value = float(value_string.strip())
+            value = sample.value
 
             # HAZL load info
             workload = labels.get("parent_name", "unknown")
@@ -139,7 +149,11 @@ def get_metrics(context=None):
 
     return metrics
 
-def print_metrics(metrics, prev_metrics, grey_count):
+def latency_columns(latency, key):
+    return " ".join(histograms.format_latency(value)
+                    for value in latency.quantiles(key))
+
+def print_metrics(metrics, prev_metrics, grey_count, latency=None):
     for workload in sorted(metrics.keys()):
         workload_metrics = metrics[workload]
         prev_workload_metrics = prev_metrics.get(workload, {})
@@ -167,11 +181,16 @@ def print_metrics(metrics, prev_metrics, grey_count):
 
                 prev_count = prev_for_zone.get(pod, 0)
                 current_count = workload_metrics[zone][pod]
-                diff = current_count - prev_count
+                diff = rates.counter_delta(prev_count, current_count)
 
                 if diff != 0:
-                    diff_pct = (diff / delta_total * 100) if delta_total >= 0 else 0
-                    output_lines.append("    %8s -> %-32s %8d (%3d%%)" % (zone, pod, diff, diff_pct))
+                    diff_pct = (diff / delta_total * 100) if delta_total > 0 else 0
+                    line = "    %8s -> %-32s %8d (%3d%%)" % (zone, pod, diff, diff_pct)
+
+                    if latency is not None:
+                        line += "  " + latency_columns(latency, (workload, zone, pod))
+
+                    output_lines.append(line)
                     grey_count[line_key] = 0
                     active_endpoints += 1
                 else:
@@ -206,6 +225,11 @@ def print_metrics(metrics, prev_metrics, grey_count):
 
                 output.extend([ f"scaled: {scaled}" ])
 
+        if (latency is not None) and (latency.quantiles((workload,))[0] is not None):
+            p50, p95, p99 = [ histograms.format_latency(value).strip()
+                              for value in latency.quantiles((workload,)) ]
+            output.append(f"p50 {p50} p95 {p95} p99 {p99} ms")
+
         print()
 
         if output:
@@ -216,20 +240,404 @@ def print_metrics(metrics, prev_metrics, grey_count):
         for line in output_lines:
             print(line)
 
+def latency_record(latency, key):
+    if latency is None:
+        return None
+
+    p50, p95, p99 = latency.quantiles(key)
+    return { "p50": p50, "p95": p95, "p99": p99 }
+
+def rate_of(delta, elapsed):
+    if (delta is None) or (not elapsed):
+        return None
+
+    return delta / elapsed
+
+def metrics_record(metrics, prev_metrics, elapsed, latency=None):
+    """The numbers print_metrics shows, as a dict for --ndjson: per
+    workload, per zone and per destination pod, the current count, the
+    delta since the last tick, the rate per second and latency percentiles
+    in milliseconds. Every level has the same keys on every tick; deltas
+    and rates are None until there's a previous sample to diff against
+    (for a pod we haven't seen before, or a zone or workload with no such
+    pods)."""
+
+    record = {}
+
+    for workload in sorted(metrics.keys()):
+        workload_metrics = metrics[workload]
+        prev_workload_metrics = prev_metrics.get(workload, {})
+        zones = {}
+        workload_delta = None
+
+        for zone in sorted(workload_metrics.keys()):
+            if (zone == "total") or (zone == "load"):
+                continue
+
+            prev_for_zone = prev_workload_metrics.get(zone, {})
+            pods = {}
+            zone_delta = None
+
+            for pod in sorted(workload_metrics[zone].keys()):
+                count = workload_metrics[zone][pod]
+                diff = None
+
+                if pod in prev_for_zone:
+                    diff = rates.counter_delta(prev_for_zone[pod], count)
+                    zone_delta = (zone_delta or 0) + diff
+
+                pods[pod] = {
+                    "count": count,
+                    "delta": diff,
+                    "rate": rate_of(diff, elapsed),
+                    "latency": latency_record(latency, (workload, zone, pod)),
+                }
+
+            zones[zone] = {
+                "delta": zone_delta,
+                "rate": rate_of(zone_delta, elapsed),
+                "latency": latency_record(latency, (workload, zone)),
+                "pods": pods,
+            }
+
+            if zone_delta is not None:
+                workload_delta = (workload_delta or 0) + zone_delta
+
+        record[workload] = {
+            "delta": workload_delta,
+            "rate": rate_of(workload_delta, elapsed),
+            "latency": latency_record(latency, (workload,)),
+            "load": dict(workload_metrics.get("load", {})),
+            "zones": zones,
+        }
+
+    return record
+
+def rebase_metrics(prev, current):
+    """Return a copy of one pod's previous metrics that's safe to diff
+    against its current ones: request counters that went down were reset
+    (the proxy restarted), so their baseline becomes zero, and counters that
+    disappeared are dropped. The per-workload totals are recomputed to
+    match."""
+
+    rebased = defaultdict(lambda: defaultdict(dict))
+
+    for workload, workload_metrics in current.items():
+        prev_workload_metrics = prev.get(workload, {})
+        rebased_workload = rebased[workload]
+        total = 0
+
+        for zone, zone_metrics in workload_metrics.items():
+            if (zone == "total") or (zone == "load"):
+                continue
+
+            prev_for_zone = prev_workload_metrics.get(zone, {})
+
+            for pod, count in zone_metrics.items():
+                if pod not in prev_for_zone:
+                    continue
+
+                baseline = count - rates.counter_delta(prev_for_zone[pod], count)
+                rebased_workload[zone][pod] = baseline
+                total += baseline
+
+        if "total" in workload_metrics:
+            rebased_workload["total"]["total"] = total
+
+        if "load" in prev_workload_metrics:
+            rebased_workload["load"] = prev_workload_metrics["load"]
+
+    return rebased
+
+def merge_metrics(pod_metrics):
+    """Merge the metrics from several client pods into one fleet-wide view.
+    Request counts just add up; the balancer load gauges don't, so for those
+    we use the mean across the pods that report them."""
+
+    merged = defaultdict(lambda: defaultdict(dict))
+    loads = defaultdict(lambda: defaultdict(list))
+
+    for metrics in pod_metrics:
+        for workload, workload_metrics in metrics.items():
+            merged_workload = merged[workload]
+
+            for zone, zone_metrics in workload_metrics.items():
+                if zone == "load":
+                    for which, value in zone_metrics.items():
+                        loads[workload][which].append(value)
+
+                    continue
+
+                merged_zone = merged_workload[zone]
+
+                for key, value in zone_metrics.items():
+                    merged_zone[key] = merged_zone.get(key, 0) + value
+
+    for workload, which_values in loads.items():
+        for which, values in which_values.items():
+            merged[workload]["load"][which] = sum(values) / len(values)
+
+    return merged
+
+def print_pod_summary(per_pod, prev_per_pod, pod_zones):
+    # One line per client pod, showing how much of each workload's traffic
+    # from that pod stayed in the pod's own zone.
+    print()
+    print("client pods (zone-local %)")
+
+    for pod in sorted(per_pod.keys()):
+        zone = pod_zones.get(pod, "")
+
+        if pod not in prev_per_pod:
+            print("%s    %-48s %-10s%s" % (GREEN, pod, zone, RESET))
+            continue
+
+        elements = []
+
+        # Diff against rebased counters, so that a proxy restart can't push
+        # the local share below 0 or past 100%.
+        prev_pod = rebase_metrics(prev_per_pod[pod], per_pod[pod])
+
+        for workload in sorted(per_pod[pod].keys()):
+            workload_metrics = per_pod[pod][workload]
+            prev_workload_metrics = prev_pod.get(workload, {})
+
+            total = workload_metrics.get("total", {}).get("total", 0)
+            prev_total = prev_workload_metrics.get("total", {}).get("total", 0)
+            delta_total = total - prev_total
+
+            if delta_total <= 0:
+                continue
+
+            local = sum(workload_metrics.get(zone, {}).values())
+            prev_local = sum(prev_workload_metrics.get(zone, {}).values())
+
+            elements.append("%s %3d%%" % (workload, (local - prev_local) * 100 / delta_total))
+
+        if elements:
+            print("    %-48s %-10s %s" % (pod, zone, "  ".join(elements)))
+        else:
+            print("%s    %-48s %-10s%s" % (GREY, pod, zone, RESET))
+
+def discover_sources(args, sources):
+    """Find every client pod we should be scraping, reusing the sources we
+    already have for pods we've seen before. Returns the new sources and the
+    zone of each pod."""
+
+    if args.replay:
+        # Replay every pod that was recorded. (We don't know their zones.)
+        if not sources:
+            sources = metricsources.replay_sources(args.replay)
+
+        return sources, {}
+
+    if args.source == "url":
+        if not sources:
+            sources = { "url": metricsources.make_source("url", "", "", url=args.url,
+                                                         record=args.record) }
+
+        return sources, {}
+
+    pods = []
+
+    for namespace in args.namespace:
+        selectors = list(args.selector)
+
+        for workload in args.workload:
+            selectors.append(metricsources.workload_selector(namespace, workload,
+                                                             context=args.context))
+
+        for selector in selectors:
+            pods.extend(metricsources.list_pods(namespace, selector,
+                                                context=args.context))
+
+    zones = metricsources.node_zones(context=args.context)
+    new_sources = {}
+    pod_zones = {}
+
+    for pod in pods:
+        key = f"{pod.namespace}/{pod.name}"
+
+        if key in new_sources:
+            continue
+
+        if key in sources:
+            new_sources[key] = sources[key]
+        else:
+            new_sources[key] = metricsources.make_source(args.source, pod.namespace,
+                                                         f"pod/{pod.name}",
+                                                         context=args.context,
+                                                         record=args.record)
+
+        pod_zones[key] = zones.get(pod.node, "")
+
+    for key, source in sources.items():
+        if key not in new_sources:
+            source.close()
+
+    return new_sources, pod_zones
+
+def scrape(executor, sources, latency):
+    # Returns the metrics for each pod that answered, the parsing stats, how
+    # many pods failed, and when the latest scrape happened by its source's
+    # clock (None if nothing answered).
+    def scrape_one(item):
+        key, source = item
+        stats = proxymetrics.ScanStats()
+        pod_latency = {}
+
+        try:
+            metrics = get_metrics(source, stats=stats, latency=pod_latency)
+            return key, metrics, pod_latency, stats, source.now()
+        except metricsources.SourceError:
+            return key, None, None, stats, None
+
+    per_pod = {}
+    stats = proxymetrics.ScanStats()
+    failed = 0
+    scraped = None
+
+    for key, metrics, pod_latency, pod_stats, when in executor.map(scrape_one, sources.items()):
+        stats.scanned += pod_stats.scanned
+        stats.parsed += pod_stats.parsed
+
+        if metrics is None:
+            failed += 1
+            continue
+
+        per_pod[key] = metrics
+        scraped = when if scraped is None else max(scraped, when)
+
+        # Each client pod's histogram for a destination pod is diffed on
+        # its own, then merged into that pod, its zone and its workload.
+        for (workload, zone, pod), buckets in pod_latency.items():
+            latency.update((key, workload, zone, pod),
+                           [ (workload, zone, pod), (workload, zone), (workload,) ],
+                           buckets)
+
+    latency.advance()
+
+    return per_pod, stats, failed, scraped
+
 def main():
-    prev_metrics = defaultdict(lambda: defaultdict(dict))
+    parser = argparse.ArgumentParser(description='Watch HAZL zone-local traffic')
+    parser.add_argument('--context', type=str, default=None, help='Kubernetes context')
+    parser.add_argument('-n', '--namespace', action='append', default=None,
+                        help='Namespace of the client pods (repeatable, default: faces)')
+    parser.add_argument('--workload', action='append', default=None,
+                        help='Client workload, e.g. deploy/face (repeatable, default: deploy/face)')
+    parser.add_argument('-l', '--selector', action='append', default=[],
+                        help='Label selector for client pods (repeatable)')
+    parser.add_argument('--parallel', type=int, default=16,
+                        help='How many pods to scrape at once')
+    parser.add_argument('--pods', action='store_true',
+                        help='Also show a zone-local summary for each client pod')
+    parser.add_argument('--rediscover', type=float, default=30.0,
+                        help='Seconds between looking for new client pods')
+    parser.add_argument('--interval', type=float, default=3.0,
+                        help='Seconds between refreshes')
+    parser.add_argument('--latency-window', type=int, default=10,
+                        help='Number of refreshes to compute latency percentiles over')
+    metricsources.add_source_arguments(parser)
+    screen.add_screen_arguments(parser)
+    records.add_record_arguments(parser)
+    args = parser.parse_args()
+
+    if args.namespace is None:
+        args.namespace = [ "faces" ]
+
+    if args.workload is None:
+        args.workload = [] if args.selector else [ "deploy/face" ]
+
+    executor = ThreadPoolExecutor(max_workers=args.parallel)
+    sources = {}
+    pod_zones = {}
+    last_discovery = None
+
+    prev_per_pod = {}
     grey_count = {}
+    last_scrape = None
+    latency = histograms.HistogramWindows(window=args.latency_window)
+
+    if args.ndjson:
+        display = records.RecordWriter(args.ndjson_buffer, args.ndjson_when_full)
+    else:
+        display = screen.make_screen(args.screen)
+
+    try:
+        while True:
+            now = time.monotonic()
+            discovery_error = None
+
+            if (last_discovery is None) or (now - last_discovery >= args.rediscover):
+                try:
+                    sources, pod_zones = discover_sources(args, sources)
+                    last_discovery = now
+                except metricsources.SourceError as e:
+                    discovery_error = e
+
+            per_pod, stats, failed, scraped = scrape(executor, sources, latency)
+
+            if (scraped is not None) and (last_scrape is not None):
+                elapsed = scraped - last_scrape
+            else:
+                elapsed = None
+
+            if scraped is not None:
+                last_scrape = scraped
+
+            current_metrics = merge_metrics(per_pod.values())
+
+            # A client pod that just showed up would count its whole history as
+            # new traffic, so diff it against itself until next time. Pods that
+            # went away simply drop out of both sides, and pods whose counters
+            # reset get diffed against zero.
+            if prev_per_pod:
+                prev_metrics = merge_metrics(rebase_metrics(prev_per_pod.get(pod, metrics), metrics)
+                                             for pod, metrics in per_pod.items())
+            else:
+                prev_metrics = {}
+
+            if args.ndjson:
+                display.emit({
+                    "time": time.time(),
+                    "elapsed": elapsed,
+                    "pods": len(per_pod),
+                    "failed": failed,
+                    "error": str(discovery_error) if discovery_error else None,
+                    "workloads": metrics_record(current_metrics, prev_metrics, elapsed, latency),
+                })
+
+                prev_per_pod = per_pod
+                time.sleep(args.interval)
+                continue
+
+            with display.frame():
+                status = f"{len(per_pod)} pod{'' if len(per_pod) == 1 else 's'}"
+
+                if failed:
+                    status += f", {RED}{failed} failed{GREY}"
+
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {GREY}({status}; {stats}){RESET}")
+
+                if discovery_error:
+                    print(f"{RED}{discovery_error}{RESET}")
 
-    while True:
-        current_metrics = get_metrics()
+                print_metrics(current_metrics, prev_metrics, grey_count, latency)
 
-        subprocess.run("clear")
-        print(time.strftime("%Y-%m-%d %H:%M:%S"))
+                if args.pods:
+                    print_pod_summary(per_pod, prev_per_pod, pod_zones)
 
-        print_metrics(current_metrics, prev_metrics, grey_count)
+            prev_per_pod = per_pod
+            time.sleep(args.interval)
+    except (metricsources.EndOfRecording, BrokenPipeError):
+        pass
+    finally:
+        display.close()
 
-        prev_metrics = current_metrics
-        time.sleep(3)
+        # Don't leave kubectl port-forwards behind.
+        for source in sources.values():
+            source.close()
 
 if __name__ == "__main__":
     main()
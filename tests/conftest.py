@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The shared modules live in tools/, and the workshop scripts import them
+# from there, so the tests do too.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
@@ -0,0 +1,34 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+
+def test_code_blocks_skip_output(tmp_path):
+    # A workshop whose shell blocks are mostly output and YAML: only the real
+    # commands should end up in the commands table.
+    shutil.copytree(os.path.join(FIXTURES, "code-blocks"), tmp_path / "workshop")
+
+    subprocess.run([ sys.executable, os.path.join(ROOT, "build-index.py"),
+                     "--code-blocks", "code.db" ],
+                   cwd=tmp_path, check=True, capture_output=True)
+
+    db = sqlite3.connect(tmp_path / "code.db")
+    blocks = db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+    commands = db.execute("SELECT section, ordinal, program, verb, command FROM commands"
+                          " ORDER BY rowid").fetchall()
+    db.close()
+
+    assert blocks == 6
+    assert commands == [
+        ("Install", 1, "linkerd", "install", "linkerd install --crds | kubectl apply -f -"),
+        ("Install", 1, "kubectl", "apply", "linkerd install --crds | kubectl apply -f -"),
+        ("Install", 1, "linkerd", "install", "linkerd install | kubectl apply -f -"),
+        ("Install", 1, "kubectl", "apply", "linkerd install | kubectl apply -f -"),
+        ("Configure", 2, "kubectl", "get", "kubectl get pods -n faces"),
+        ("Configure", 4, "kubectl", "get", "kubectl get nodes"),
+        ("Configure", 4, "kubectl", "get", "FACE_POD=$(kubectl get pods -n faces -o name)"),
+    ]
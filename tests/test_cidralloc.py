@@ -0,0 +1,59 @@
+import ipaddress
+
+import pytest
+
+from cidralloc import AllocationError, CIDRAllocator, network_allocators
+
+def test_allocate_skips_reserved():
+    allocator = CIDRAllocator("10.0.0.0/24", reserved=[ "10.0.0.1", "10.0.0.16/28" ])
+
+    # 10.0.0.0/28 holds 10.0.0.1, and the next /28 is reserved outright.
+    assert str(allocator.allocate(28)) == "10.0.0.32/28"
+    assert str(allocator.allocate(28)) == "10.0.0.48/28"
+
+def test_allocate_at_taken_address_falls_back():
+    allocator = CIDRAllocator("10.0.0.0/24", reserved=[ "10.0.0.70" ])
+
+    assert str(allocator.allocate(28, at="10.0.0.64")) == "10.0.0.0/28"
+    assert str(allocator.allocate(28, at="10.0.0.160")) == "10.0.0.160/28"
+
+def test_allocations_never_overlap():
+    allocator = CIDRAllocator("10.0.0.0/24", reserved=[ "10.0.0.5" ])
+    pools = [ allocator.allocate(prefixlen) for prefixlen in [ 28, 26, 28, 27, 30 ] ]
+
+    for i, pool in enumerate(pools):
+        assert not pool.overlaps(ipaddress.ip_network("10.0.0.5/32"))
+
+        for other in pools[i + 1:]:
+            assert not pool.overlaps(other)
+
+def test_allocate_until_full():
+    allocator = CIDRAllocator("10.0.0.0/28", reserved=[ "10.0.0.0/30" ])
+
+    assert [ str(allocator.allocate(30)) for _ in range(3) ] == \
+        [ "10.0.0.4/30", "10.0.0.8/30", "10.0.0.12/30" ]
+
+    with pytest.raises(AllocationError):
+        allocator.allocate(30)
+
+def test_network_allocators_reserve_docker_addresses():
+    network = {
+        "IPAM": { "Config": [
+            { "Subnet": "172.18.0.0/24", "Gateway": "172.18.0.1" },
+            { "Subnet": "fc00:f853:ccd:e793::/64", "Gateway": "fc00:f853:ccd:e793::1" },
+        ] },
+        "Containers": {
+            "abc": { "IPv4Address": "172.18.0.2/24", "IPv6Address": "fc00:f853:ccd:e793::2/64" },
+            "def": { "IPv4Address": "172.18.0.20/24" },
+        },
+    }
+
+    v4, v6 = network_allocators(network)
+
+    for address in [ "172.18.0.0", "172.18.0.1", "172.18.0.2", "172.18.0.20", "172.18.0.255" ]:
+        assert not v4.is_free(address)
+
+    # The first two /28s each hold something docker uses, as does the first
+    # /96.
+    assert str(v4.allocate(28)) == "172.18.0.32/28"
+    assert str(v6.allocate(96)) == "fc00:f853:ccd:e793:0:1::/96"
@@ -0,0 +1,26 @@
+import genmetrics
+
+from proxymetrics import iter_samples
+
+def test_generate_parses():
+    lines = list(genmetrics.generate(series=500, tick=1))
+    samples = list(iter_samples(lines))
+
+    assert len(samples) >= 500
+    assert { "request_total", "response_latency_ms_bucket",
+             "outbound_http_route_request_statuses_total" } <= { sample.name for sample in samples }
+
+def test_generate_is_deterministic():
+    assert list(genmetrics.generate(series=200, tick=2)) == list(genmetrics.generate(series=200, tick=2))
+
+def test_counters_grow_with_tick():
+    def totals(tick):
+        return { tuple(sorted(sample.labels.items())): sample.value
+                 for sample in iter_samples(genmetrics.generate(tick=tick), prefixes=[ "request_total" ]) }
+
+    before = totals(0)
+    after = totals(1)
+
+    assert before.keys() == after.keys()
+    assert all(after[key] >= before[key] for key in before)
+    assert sum(after.values()) > sum(before.values())
@@ -0,0 +1,54 @@
+import pytest
+
+from histograms import INF, HistogramWindows, bucket_bound, format_latency, quantile
+
+BOUNDS = ( 10.0, 20.0, 50.0, INF )
+
+def test_bucket_bound():
+    assert bucket_bound({ "le": "10" }) == 10.0
+    assert bucket_bound({ "le": "+Inf" }) == INF
+    assert bucket_bound({}) == INF
+
+def test_quantile_interpolates_within_bucket():
+    # 100 observations: 40 under 10ms, 40 more under 20ms, 20 more under 50ms.
+    counts = ( 40, 80, 100, 100 )
+
+    # The median is the 50th: 10 of the 40 in the (10, 20] bucket.
+    assert quantile(0.5, BOUNDS, counts) == pytest.approx(12.5)
+
+    # The 95th is 15 of the 20 in (20, 50].
+    assert quantile(0.95, BOUNDS, counts) == pytest.approx(42.5)
+
+    # The first bucket interpolates up from zero.
+    assert quantile(0.2, BOUNDS, counts) == pytest.approx(5.0)
+
+def test_quantile_in_inf_bucket():
+    # Past the highest finite bound, all we can say is "more than 50".
+    assert quantile(0.99, BOUNDS, ( 0, 0, 50, 100 )) == 50.0
+
+def test_quantile_without_observations():
+    assert quantile(0.5, BOUNDS, ( 0, 0, 0, 0 )) is None
+    assert quantile(0.5, BOUNDS, ()) is None
+
+def test_windows_diff_and_reset():
+    latency = HistogramWindows(window=10)
+
+    latency.update("pod", [ "pod" ], dict(zip(BOUNDS, ( 100, 100, 100, 100 ))))
+    latency.advance()
+    assert latency.quantiles("pod") == [ None, None, None ]
+
+    # Only the 100 new observations count, and they're all in (10, 20].
+    latency.update("pod", [ "pod" ], dict(zip(BOUNDS, ( 100, 200, 200, 200 ))))
+    latency.advance()
+    assert latency.quantiles("pod", qs=(0.5,)) == [ pytest.approx(15.0) ]
+
+    # The +Inf bucket went down, so the proxy restarted: its counts are all
+    # new, and fall in the first bucket.
+    latency.update("pod", [ "pod" ], dict(zip(BOUNDS, ( 100, 100, 100, 100 ))))
+    latency.advance()
+    assert latency.quantiles("pod", qs=(0.5,)) == [ pytest.approx(10.0) ]
+
+def test_format_latency():
+    assert format_latency(None) == "    -"
+    assert format_latency(2.5) == "  2.5"
+    assert format_latency(250) == "  250"
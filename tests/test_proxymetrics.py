@@ -0,0 +1,65 @@
+import math
+
+from proxymetrics import iter_samples, parse_line
+
+def test_escaped_labels():
+    sample = parse_line(r'request_total{path="/a\"b\\c",note="line\nbreak"} 3')
+
+    assert sample.labels == { "path": '/a"b\\c', "note": "line\nbreak" }
+    assert sample.value == 3.0
+
+def test_comma_in_label():
+    sample = parse_line('request_total{authority="a,b",tls="true"} 7 1735689600000')
+
+    assert sample.labels == { "authority": "a,b", "tls": "true" }
+    assert sample.timestamp == 1735689600000
+
+def test_closing_brace_in_label():
+    sample = parse_line('request_total{route="{id}"} 1')
+
+    assert sample.labels == { "route": "{id}" }
+
+def test_special_values():
+    assert math.isnan(parse_line("gauge NaN").value)
+    assert parse_line("gauge +Inf").value == math.inf
+    assert parse_line("gauge -Inf").value == -math.inf
+
+def test_inf_bucket_label():
+    sample = parse_line('response_latency_ms_bucket{le="+Inf"} 10')
+
+    assert sample.labels["le"] == "+Inf"
+
+def test_skipped_family():
+    lines = [
+        "# TYPE foo counter",
+        "foo_total 1",
+        "# TYPE request_total counter",
+        "request_total 2",
+    ]
+
+    assert [ (s.name, s.value) for s in iter_samples(lines, prefixes=["request_total"]) ] == \
+        [ ("request_total", 2.0) ]
+
+def test_untyped_sample_after_skipped_family():
+    # Untyped samples belong to no family, so the last # TYPE header mustn't
+    # decide whether they're kept.
+    lines = [
+        "# TYPE foo counter",
+        "foo_total 1",
+        'request_total{direction="outbound"} 3',
+    ]
+
+    samples = list(iter_samples(lines, prefixes=["request_total"]))
+
+    assert [ (s.name, s.labels, s.value) for s in samples ] == \
+        [ ("request_total", { "direction": "outbound" }, 3.0) ]
+
+def test_untyped_sample_sharing_prefix_with_skipped_family():
+    lines = [
+        "# TYPE foo counter",
+        "foo 1",
+        "foo_total 2",
+        "foo_bar 3",
+    ]
+
+    assert [ s.name for s in iter_samples(lines, prefixes=["foo_b"]) ] == [ "foo_bar" ]
@@ -0,0 +1,51 @@
+import pytest
+
+from rates import RingBuffer, SeriesWindows, counter_delta
+
+def test_counter_delta():
+    assert counter_delta(10, 15) == 5
+    assert counter_delta(10, 10) == 0
+
+def test_counter_delta_after_reset():
+    # The counter went down, so the proxy restarted and everything it has
+    # now is new.
+    assert counter_delta(100, 7) == 7
+    assert counter_delta(100, 0) == 0
+
+def test_ring_buffer_window():
+    ring = RingBuffer(3)
+
+    for value in [ 1, 2, 3, 4 ]:
+        ring.append(value)
+
+    assert len(ring) == 3
+    assert ring.mean() == pytest.approx(3.0)
+    assert ring.last() == 4
+
+def test_rate_across_reset():
+    windows = SeriesWindows(window=10)
+
+    assert windows.update("route", 100, 0.0) is None
+    assert windows.update("route", 150, 5.0) == pytest.approx(10.0)
+
+    # Reset to 20: that's 20 new requests, not -130.
+    assert windows.update("route", 20, 10.0) == pytest.approx(70 / 10.0)
+    assert windows.delta("route") == 20
+
+def test_rate_uses_real_elapsed_time():
+    windows = SeriesWindows(window=10)
+
+    windows.update("route", 0, 0.0)
+
+    # A late scrape: 30 requests over 6s is 5/s, whatever the poll interval.
+    assert windows.update("route", 30, 6.0) == pytest.approx(5.0)
+
+def test_idle_series_evicted():
+    windows = SeriesWindows(window=2, evict_after=2)
+
+    windows.update("route", 1, 0.0)
+
+    for _ in range(3):
+        windows.advance()
+
+    assert len(windows) == 0
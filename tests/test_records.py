@@ -0,0 +1,24 @@
+import io
+import json
+import math
+import sys
+
+from records import RecordWriter, finite
+
+def test_finite():
+    record = { "rate": math.nan, "routes": [ { "rate": math.inf }, (1.5, -math.inf) ], "count": 3 }
+
+    assert finite(record) == { "rate": None, "routes": [ { "rate": None }, [ 1.5, None ] ], "count": 3 }
+
+def test_writer_writes_one_record_per_line(monkeypatch):
+    out = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", out)
+
+    writer = RecordWriter(size=10)
+    writer.emit({ "time": 1.0, "rate": math.nan })
+    writer.emit({ "time": 2.0, "rate": 0.5 })
+    writer.close()
+
+    assert [ json.loads(line) for line in out.getvalue().splitlines() ] == \
+        [ { "time": 1.0, "rate": None }, { "time": 2.0, "rate": 0.5 } ]
+    assert sys.stdout is out
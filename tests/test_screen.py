@@ -0,0 +1,77 @@
+import io
+import sys
+
+from screen import ANSIScreen
+
+def draw_frames(monkeypatch, *frames):
+    monkeypatch.setenv("COLUMNS", "80")
+    monkeypatch.setenv("LINES", "24")
+
+    out = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", out)
+    monkeypatch.setattr(sys, "stderr", io.StringIO())
+
+    screen = ANSIScreen()
+    writes = []
+
+    try:
+        for frame in frames:
+            start = len(out.getvalue())
+
+            with screen.frame():
+                for line in frame:
+                    print(line)
+
+            writes.append(out.getvalue()[start:])
+    finally:
+        screen.close()
+
+    return writes
+
+def test_first_frame_clears(monkeypatch):
+    first, = draw_frames(monkeypatch, [ "one", "two" ])
+
+    assert "\033[2J" in first
+    assert "one" in first and "two" in first
+
+def test_only_changed_lines_redrawn(monkeypatch):
+    _, second = draw_frames(monkeypatch, [ "12:00:00", "route 1/s" ], [ "12:00:05", "route 1/s" ])
+
+    assert "\033[2J" not in second
+    assert "\033[1;1H12:00:05" in second
+    assert "route" not in second
+
+def test_error_line_stays_in_frame(monkeypatch):
+    # An error drawn inside the frame is just another line, so it doesn't
+    # force a full redraw the way stray output does.
+    error = "Error fetching http://127.0.0.1:9/metrics: Connection refused"
+    _, second = draw_frames(monkeypatch, [ "12:00:00", error ], [ "12:00:05", error ])
+
+    assert "\033[2J" not in second
+    assert error not in second
+
+def test_stray_output_forces_redraw(monkeypatch):
+    monkeypatch.setenv("COLUMNS", "80")
+    monkeypatch.setenv("LINES", "24")
+
+    out = io.StringIO()
+    err = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", out)
+    monkeypatch.setattr(sys, "stderr", err)
+
+    screen = ANSIScreen()
+
+    try:
+        with screen.frame():
+            print("one")
+
+        print("stray")
+        start = len(out.getvalue())
+
+        with screen.frame():
+            print("one")
+    finally:
+        screen.close()
+
+    assert err.getvalue() == "stray\n"
+    assert "\033[2J" in out.getvalue()[start:]
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Run every proxy metrics parser and aggregator in the repo against
+# synthetic dumps from genmetrics.py at a few scales, and report how long
+# each one takes and how much memory it needs. The shared modules are
+# timed in-process; the workshop scripts are run whole, replaying a
+# recorded archive of the dumps as fast as they can, since that's how
+# they'd really be used.
+#
+# python bench-mesh.py                          # 10k, 100k and 1M series
+# python bench-mesh.py --scales 10000 --save baseline.json
+# python bench-mesh.py --scales 10000 --baseline baseline.json
+#
+# With --baseline, anything that got more than --tolerance slower or
+# bigger than the baseline is flagged, and the exit status is 1.
+
+import sys
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import genmetrics
+import histograms
+import proxymetrics
+import rates
+
+from scrapearchive import ArchiveWriter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The scripts, and how to run them against an archive (or a single dump on
+# stdin, for the ones that read stdin).
+SCRIPTS = [
+    ( "zone-metrics", [ "reduce-costs-with-hazl/zone-metrics.py", "--ndjson", "--interval", "0" ] ),
+    ( "crunch_service_metrics", [ "federated-services/crunch_service_metrics.py", "--ndjson", "--interval", "0", "bench" ] ),
+    ( "linkerd-egress/metrics", [ "linkerd-egress/metrics.py", "--ndjson", "--interval", "0" ] ),
+    ( "2-17-features/metrics", [ "2-17-features/metrics.py", "--ndjson", "--interval", "0" ] ),
+    ( "crunch-metrics", [ "2-15-features/crunch-metrics.py" ] ),
+]
+
+
+def in_process(func, dumps, repeat):
+    """Time func over the dumps (the best of repeat runs), then run it
+    again under tracemalloc for its peak memory (tracemalloc slows things
+    down too much to do both at once)."""
+
+    elapsed = None
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(dumps)
+        took = time.perf_counter() - start
+
+        if (elapsed is None) or (took < elapsed):
+            elapsed = took
+
+    tracemalloc.start()
+    func(dumps)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def parse_all(dumps):
+    for text in dumps:
+        for sample in proxymetrics.iter_samples(text.splitlines()):
+            pass
+
+
+def parse_prefixes(dumps):
+    for text in dumps:
+        for sample in proxymetrics.iter_samples(text.splitlines(), prefixes=[ "request_total" ]):
+            pass
+
+
+def series_windows(dumps):
+    windows = rates.SeriesWindows()
+
+    for tick, text in enumerate(dumps):
+        for sample in proxymetrics.iter_samples(text.splitlines()):
+            windows.update((sample.name, tuple(sorted(sample.labels.items()))),
+                           sample.value, tick * 5.0)
+
+        windows.advance()
+
+
+def histogram_windows(dumps):
+    # As zone-metrics.py does it: each destination pod's latency buckets
+    # (summed over status codes) go into the pod, its zone and its
+    # workload, and every group's percentiles are read back each tick.
+    latency = histograms.HistogramWindows()
+
+    for text in dumps:
+        buckets = {}
+
+        for sample in proxymetrics.iter_samples(text.splitlines(), prefixes=[ "response_latency_ms_bucket" ]):
+            labels = sample.labels
+            key = (labels.get("dst_service", ""), labels.get("dst_zone", ""), labels.get("dst_pod", ""))
+            pod_buckets = buckets.setdefault(key, {})
+            bound = histograms.bucket_bound(labels)
+            pod_buckets[bound] = pod_buckets.get(bound, 0) + sample.value
+
+        for (workload, zone, pod), counts in buckets.items():
+            latency.update((workload, zone, pod),
+                           [ (workload, zone, pod), (workload, zone), (workload,) ], counts)
+
+        latency.advance()
+
+        for key in latency.groups:
+            latency.quantiles(key)
+
+
+IN_PROCESS = [
+    ( "proxymetrics (all)", parse_all ),
+    ( "proxymetrics (prefix)", parse_prefixes ),
+    ( "rates.SeriesWindows", series_windows ),
+    ( "histograms.HistogramWindows", histogram_windows ),
+]
+
+
+# A child's ru_maxrss starts out at whatever its parent's was when it forked
+# (which, for us, includes all the dumps), so the scripts run under this
+# wrapper, which writes the script's own peak RSS to a file when it exits.
+WRAPPER = """
+import atexit, resource, runpy, sys
+
+def report(path=sys.argv[1]):
+    peak = None
+
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmHWM:"):
+                peak = int(line.split()[1])
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    open(path, "w").write(str(peak * 1024))
+
+atexit.register(report)
+sys.argv = sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def run_script(args, archive, dump, repeat, tmp):
+    """Run one script to completion (repeat times); return its best wall
+    time and its peak RSS."""
+
+    peak_file = os.path.join(tmp, "peak")
+    cmd = [ sys.executable, "-c", WRAPPER, peak_file, os.path.join(ROOT, args[0]) ] + args[1:]
+
+    if not args[0].endswith("crunch-metrics.py"):
+        cmd.extend([ "--replay", archive ])
+
+    elapsed = None
+    peak = 0
+
+    for i in range(repeat):
+        with open(dump) as stdin:
+            start = time.perf_counter()
+            subprocess.run(cmd, stdin=stdin, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+            took = time.perf_counter() - start
+
+        if (elapsed is None) or (took < elapsed):
+            elapsed = took
+
+        peak = max(peak, int(open(peak_file).read()))
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the metrics parsers and aggregators')
+    parser.add_argument('--scales', type=str, default="10000,100000,1000000",
+                        help='Comma-separated numbers of series per dump')
+    parser.add_argument('--ticks', type=int, default=3, help='Scrapes per run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark (the best one counts)')
+    parser.add_argument('--zones', type=int, default=3, help='Zones in the mesh')
+    parser.add_argument('--pods', type=int, default=30, help='Pods per destination workload')
+    parser.add_argument('--routes', type=int, default=20, help='Routes per protocol')
+    parser.add_argument('--save', type=str, default=None, help='Save the results as JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare against saved results')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower or bigger than the baseline counts as a regression')
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for series in [ int(scale) for scale in args.scales.split(",") ]:
+            dumps = [ "\n".join(genmetrics.generate(zones=args.zones, pods=args.pods,
+                                                    routes=args.routes, series=series,
+                                                    tick=tick)) + "\n"
+                      for tick in range(args.ticks) ]
+
+            dump = os.path.join(tmp, f"{series}.txt")
+            archive = os.path.join(tmp, f"{series}.archive")
+
+            with open(dump, "w") as f:
+                f.write(dumps[0])
+
+            # Fast compression: we only care about the scripts' time.
+            writer = ArchiveWriter(archive, level=1)
+
+            for tick, text in enumerate(dumps):
+                writer.append("bench", text, when=tick * 5.0)
+
+            writer.close()
+
+            for name, func in IN_PROCESS:
+                elapsed, peak = in_process(func, dumps, args.repeat)
+                results.append({ "name": name, "series": series, "seconds": elapsed, "peak": peak })
+
+            del dumps
+
+            for name, script in SCRIPTS:
+                elapsed, peak = run_script(script, archive, dump, args.repeat, tmp)
+                results.append({ "name": name, "series": series, "seconds": elapsed, "peak": peak })
+
+            for result in results:
+                if result["series"] == series:
+                    print("%-28s %8d series  %8.3fs  %8.1f MB peak" %
+                          (result["name"], series, result["seconds"], result["peak"] / 1e6))
+
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        baseline = { (result["name"], result["series"]): result
+                     for result in json.load(open(args.baseline)) }
+        regressions = 0
+
+        for result in results:
+            base = baseline.get((result["name"], result["series"]))
+
+            if base is None:
+                continue
+
+            for what in [ "seconds", "peak" ]:
+                if result[what] > base[what] * (1 + args.tolerance):
+                    print("REGRESSION %s at %d series: %s %.3g -> %.3g" %
+                          (result["name"], result["series"], what, base[what], result[what]))
+                    regressions += 1
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions against %s" % args.baseline)
+
+
+if __name__ == "__main__":
+    main()
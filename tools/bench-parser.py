@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Compare the shared proxymetrics parser against the old split(',') parsers
+# that used to live in the individual workshop scripts.
+#
+# python bench-parser.py [series]
+
+import sys
+
+import time
+
+import proxymetrics
+
+LINE = 'outbound_http_route_request_statuses_total{parent_group="policy.linkerd.io",parent_kind="EgressNetwork",parent_namespace="linkerd-egress",parent_name="all-egress",parent_port="80",parent_section_name="",route_group="gateway.networking.k8s.io",route_kind="HTTPRoute",route_namespace="faces",route_name="route-%d",hostname="smiley",http_status="200",error=""} %d'
+NOISE = 'tcp_open_total{direction="inbound",peer="src",target_addr="10.42.0.%d:4191",target_ip="10.42.0.%d",target_port="4191",tls="no_identity",no_tls_reason="no_authority_in_http_request",srv_kind="default",srv_name="all-unauthenticated"} %d'
+
+
+def old_parse_labels(label_str):
+    labels = {}
+
+    for item in label_str.split(','):
+        if '=' in item:
+            k, v = item.split('=', 1)
+            labels[k.strip()] = v.strip().strip('"')
+
+    return labels
+
+
+def old_parser(lines, prefix):
+    count = 0
+
+    for line in lines:
+        if line.startswith("#") or not line.strip():
+            continue
+
+        if '{' not in line or '}' not in line:
+            continue
+
+        metric_name, rest = line.split("{", maxsplit=1)
+        label_string, value = rest.split("}", maxsplit=1)
+
+        if metric_name.strip().startswith(prefix):
+            old_parse_labels(label_string)
+            int(value.strip())
+            count += 1
+
+    return count
+
+
+def new_parser(lines, prefix):
+    count = 0
+
+    for sample in proxymetrics.iter_samples(lines, prefixes=[prefix]):
+        count += 1
+
+    return count
+
+
+def timed(name, func, lines, prefix):
+    start = time.perf_counter()
+    count = func(lines, prefix)
+    elapsed = time.perf_counter() - start
+
+    print("%-8s %8d series in %7.3fs (%10.0f lines/s)" %
+          (name, count, elapsed, len(lines) / elapsed))
+
+
+def main():
+    series = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    # One in ten lines is something we care about; the rest is the sort of
+    # noise a busy proxy exports.
+    lines = []
+
+    for i in range(series):
+        if i % 10 == 0:
+            lines.append(LINE % (i, i))
+        else:
+            lines.append(NOISE % (i % 256, i % 256, i))
+
+    prefix = "outbound_http_route_request_statuses_total"
+
+    timed("old", old_parser, lines, prefix)
+    timed("new", new_parser, lines, prefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Measure how fast recorded scrapes go through the parse-and-delta pipeline
+# the metrics scripts share: decompress each scrape, parse every series with
+# proxymetrics, and feed the counters through rates.SeriesWindows, using the
+# times the scrapes were recorded. No cluster or network needed.
+#
+# python bench-replay.py ARCHIVE [--prefix PREFIX ...]
+#
+# To make an archive, run any of the metrics scripts with --record ARCHIVE,
+# or turn a handful of metrics dumps into one (5s apart) with
+#
+# python bench-replay.py --write ARCHIVE dump1.txt dump2.txt ...
+
+import argparse
+import time
+
+import proxymetrics
+import rates
+
+from scrapearchive import ArchiveReader, ArchiveWriter
+
+
+def write_archive(path, dumps):
+    writer = ArchiveWriter(path)
+    when = time.time()
+
+    for dump in dumps:
+        writer.append("dump", open(dump).read(), when=when)
+        when += 5
+
+    writer.close()
+    print(f"Wrote {len(dumps)} scrape(s) to {path}")
+
+
+def replay(reader, prefixes):
+    windows = rates.SeriesWindows()
+    decompress = 0.0
+    process = 0.0
+    scrapes = 0
+    series = 0
+    nbytes = 0
+
+    for record in reader.records:
+        start = time.perf_counter()
+        text = reader.text(record)
+        decompressed = time.perf_counter()
+
+        for sample in proxymetrics.iter_samples(text.splitlines(), prefixes=prefixes):
+            key = (record.key, sample.name, tuple(sorted(sample.labels.items())))
+            windows.update(key, sample.value, record.time)
+            series += 1
+
+        windows.advance()
+        done = time.perf_counter()
+
+        decompress += decompressed - start
+        process += done - decompressed
+        scrapes += 1
+        nbytes += len(text)
+
+    return scrapes, series, nbytes, decompress, process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark replaying recorded scrapes')
+    parser.add_argument('--write', action='store_true',
+                        help='Write the given dumps to ARCHIVE instead of benchmarking it')
+    parser.add_argument('--prefix', action='append', default=None,
+                        help='Only parse series with this prefix, like the scripts do (repeatable)')
+    parser.add_argument('archive', help='Scrape archive')
+    parser.add_argument('dumps', nargs='*', help='Metrics dumps for --write')
+    args = parser.parse_args()
+
+    if args.write:
+        write_archive(args.archive, args.dumps)
+        return
+
+    start = time.perf_counter()
+    reader = ArchiveReader(args.archive)
+    indexed = time.perf_counter() - start
+
+    scrapes, series, nbytes, decompress, process = replay(reader, args.prefix)
+    elapsed = decompress + process
+
+    print("%d scrapes (%d keys) indexed in %.3fs" % (scrapes, len(reader.keys()), indexed))
+    print("decompress %7.3fs (%8.1f MB/s)" % (decompress, nbytes / decompress / 1e6))
+    print("parse+rate %7.3fs (%8.0f series/s)" % (process, series / process))
+    print("total      %7.3fs (%8.1f scrapes/s, %8.0f series/s)" %
+          (elapsed, scrapes / elapsed, series / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Check that the egress metrics scripts actually find latency for their
+# routes. Latency comes from histograms labeled with the authority
+# (smiley.faces.svc.cluster.local:80) while routes carry a hostname
+# (smiley), so if the two ever stop meeting every latency column quietly
+# turns into "-". This replays a few ticks of genmetrics.py dumps through
+# each script with --ndjson, and fails unless some route has a quantile.
+#
+# python check-egress-latency.py [--series 2000] [--ticks 4]
+
+import sys
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+
+import genmetrics
+
+from scrapearchive import ArchiveWriter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCRIPTS = [ "linkerd-egress/metrics.py", "2-17-features/metrics.py" ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the egress scripts report route latency')
+    parser.add_argument('--series', type=int, default=2000, help='Series per dump')
+    parser.add_argument('--ticks', type=int, default=4, help='Scrapes to replay')
+    args = parser.parse_args()
+
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "egress.archive")
+        writer = ArchiveWriter(archive, level=1)
+
+        for tick in range(args.ticks):
+            writer.append("check", "\n".join(genmetrics.generate(series=args.series, tick=tick)) + "\n",
+                          when=tick * 5.0)
+
+        writer.close()
+
+        for script in SCRIPTS:
+            result = subprocess.run([ sys.executable, os.path.join(ROOT, script),
+                                      "--ndjson", "--interval", "0", "--replay", archive ],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True, check=True)
+
+            routes = 0
+            with_latency = 0
+
+            for line in result.stdout.splitlines():
+                for route in json.loads(line)["routes"]:
+                    routes += 1
+
+                    if any(value is not None for value in route["latency"].values()):
+                        with_latency += 1
+
+            ok = with_latency > 0
+            print("%-28s %6d route samples, %6d with latency: %s" %
+                  (script, routes, with_latency, "ok" if ok else "NO LATENCY"))
+
+            if not ok:
+                failures += 1
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Carve address pools (for MetalLB, say) out of the subnets of a Docker
+# network, so that lots of kind or k3d clusters can share one network
+# without their pools overlapping each other, the network's gateway, or the
+# addresses Docker has already handed out to containers.
+#
+# Each subnet's free space is kept as a sorted list of disjoint address
+# intervals, so bisect finds the interval holding any address in O(log n).
+# Taking space out (reserving or allocating) splices those lists, though,
+# so that's O(n) in the number of intervals. Pools are aligned networks of
+# whatever size you ask for. Allocating one picks up where the last search
+# for that size stopped, since the free space only ever shrinks, so the
+# search itself doesn't start over every time.
+#
+# docker network inspect kind | python cidralloc.py --clusters 24
+#
+# prints one line per cluster, with a pool from each of the network's
+# subnets.
+
+import sys
+
+import argparse
+import bisect
+import ipaddress
+import json
+
+
+class AllocationError(Exception):
+    pass
+
+
+class CIDRAllocator:
+    """Allocates aligned, non-overlapping networks from one subnet."""
+
+    def __init__(self, subnet, reserved=()):
+        self.subnet = ipaddress.ip_network(subnet, strict=False)
+
+        # The free space, as [start, end) intervals of integer addresses, in
+        # two parallel lists so that we can bisect on either.
+        self.starts = [ int(self.subnet.network_address) ]
+        self.ends = [ int(self.subnet.broadcast_address) + 1 ]
+
+        # For each prefix length, an address below which there's no room
+        # for a network that size.
+        self.cursors = {}
+
+        for what in reserved:
+            self.reserve(what)
+
+    def span(self, what):
+        network = ipaddress.ip_network(what, strict=False)
+
+        if network.version != self.subnet.version:
+            raise AllocationError(f"{network} isn't an IPv{self.subnet.version} network")
+
+        return int(network.network_address), int(network.broadcast_address) + 1
+
+    def reserve(self, what):
+        """Take an address or network out of the free space. Any part of it
+        that's outside the subnet, or already taken, is ignored. Finding
+        where it goes is O(log n), but splicing it out is O(n)."""
+
+        start, end = self.span(what)
+
+        # The first interval that ends after start...
+        i = bisect.bisect_right(self.ends, start)
+
+        # ...and every one after it that starts before end gets trimmed, or
+        # split in two, or dropped.
+        while (i < len(self.starts)) and (self.starts[i] < end):
+            pieces = []
+
+            if self.starts[i] < start:
+                pieces.append((self.starts[i], start))
+
+            if end < self.ends[i]:
+                pieces.append((end, self.ends[i]))
+
+            self.starts[i:i + 1] = [ piece[0] for piece in pieces ]
+            self.ends[i:i + 1] = [ piece[1] for piece in pieces ]
+            i += len(pieces)
+
+    def is_free(self, what):
+        start, end = self.span(what)
+        i = bisect.bisect_right(self.ends, start)
+
+        return (i < len(self.starts)) and (self.starts[i] <= start) and (end <= self.ends[i])
+
+    def allocate(self, prefixlen, at=None):
+        """Allocate a /prefixlen network: the one starting at address at, if
+        that's free (and suitably aligned), or else the lowest free one.
+        Raises AllocationError if there's no room left."""
+
+        if not (self.subnet.prefixlen <= prefixlen <= self.subnet.max_prefixlen):
+            raise AllocationError(f"A /{prefixlen} can't come from {self.subnet}")
+
+        size = 1 << (self.subnet.max_prefixlen - prefixlen)
+
+        if at is not None:
+            start = int(ipaddress.ip_address(at))
+
+            if start % size == 0:
+                network = type(self.subnet)((start, prefixlen))
+
+                if network.subnet_of(self.subnet) and self.is_free(network):
+                    return self.take(start, prefixlen)
+
+        cursor = self.cursors.get(prefixlen, int(self.subnet.network_address))
+        i = bisect.bisect_right(self.ends, cursor)
+
+        while i < len(self.starts):
+            # Round up to the first aligned address in this interval.
+            start = -(-max(self.starts[i], cursor) // size) * size
+
+            if start + size <= self.ends[i]:
+                # Nothing below start + size has room for this size now.
+                self.cursors[prefixlen] = start + size
+                return self.take(start, prefixlen)
+
+            i += 1
+
+        self.cursors[prefixlen] = int(self.subnet.broadcast_address) + 1
+        raise AllocationError(f"No room for a /{prefixlen} left in {self.subnet}")
+
+    def take(self, start, prefixlen):
+        network = type(self.subnet)((start, prefixlen))
+        self.reserve(network)
+
+        return network
+
+
+def network_allocators(network):
+    """One CIDRAllocator per IPAM subnet of a Docker network (an element of
+    `docker network inspect` output), with the network's gateways,
+    container address ranges, auxiliary addresses and containers' addresses
+    already reserved, as are the subnet's own network address and (for
+    IPv4) its broadcast address."""
+
+    configs = (network.get('IPAM') or {}).get('Config') or []
+
+    if not configs:
+        raise AllocationError("No IPAM configuration found in docker inspect output")
+
+    reserved = []
+
+    for config in configs:
+        for key in [ 'Gateway', 'IPRange' ]:
+            if config.get(key):
+                reserved.append(config[key])
+
+        reserved.extend((config.get('AuxiliaryAddresses') or {}).values())
+
+    for container in (network.get('Containers') or {}).values():
+        for key in [ 'IPv4Address', 'IPv6Address' ]:
+            if container.get(key):
+                reserved.append(ipaddress.ip_interface(container[key]).ip)
+
+    allocators = []
+
+    for config in configs:
+        subnet = config.get('Subnet')
+
+        if not subnet:
+            raise AllocationError(f"No subnet found in IPAM configuration {config}")
+
+        try:
+            allocator = CIDRAllocator(subnet)
+        except ValueError as e:
+            raise AllocationError(f"Bad subnet {subnet}: {e}")
+
+        allocator.reserve(allocator.subnet.network_address)
+
+        if allocator.subnet.version == 4:
+            allocator.reserve(allocator.subnet.broadcast_address)
+
+        for what in reserved:
+            what = ipaddress.ip_network(what, strict=False)
+
+            if (what.version == allocator.subnet.version) and what.overlaps(allocator.subnet):
+                allocator.reserve(what)
+
+        allocators.append(allocator)
+
+    return allocators
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Allocate address pools for clusters from `docker network inspect` output on stdin')
+    parser.add_argument('--clusters', type=int, default=1, help='Number of clusters to allocate pools for')
+    parser.add_argument('--ipv4-prefix', type=int, default=28, help='Prefix length of each IPv4 pool')
+    parser.add_argument('--ipv6-prefix', type=int, default=96, help='Prefix length of each IPv6 pool')
+    args = parser.parse_args()
+
+    try:
+        config = json.load(sys.stdin)
+        allocators = network_allocators(config[0] if config else {})
+
+        for cluster in range(args.clusters):
+            pools = [ allocator.allocate(args.ipv4_prefix if allocator.subnet.version == 4 else args.ipv6_prefix)
+                      for allocator in allocators ]
+
+            print(" ".join(str(pool) for pool in pools))
+    except (AllocationError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Generate synthetic proxy metrics dumps that look like what a client pod
+# in a big mesh exports: per-pod request_total and latency histograms for
+# the color and smiley workloads spread across zones, HTTP and gRPC route
+# statuses (with errors), route backend counters, HAZL balancer gauges, and
+# as much other noise as it takes to reach the number of series asked for.
+#
+# Counters grow with --tick, so successive ticks make a sensible sequence
+# of scrapes:
+#
+# python genmetrics.py --series 100000 --tick 0 > dump0.txt
+# python genmetrics.py --series 100000 --tick 1 > dump1.txt
+
+import sys
+
+import argparse
+import math
+import random
+
+WORKLOADS = [ "color", "smiley" ]
+
+HTTP_STATUSES = [ ("200", ""), ("503", ""), ("504", ""), ("", "FAIL_FAST"), ("", "LOAD_SHED") ]
+GRPC_STATUSES = [ ("OK", ""), ("UNAVAILABLE", ""), ("UNKNOWN", ""), ("UNKNOWN", "FAIL_FAST") ]
+
+LATENCY_BUCKETS = [ 1, 2, 3, 4, 5, 10, 20, 30, 40, 50, 100, 200, 300, 400, 500,
+                    1000, 2000, 3000, 4000, 5000, 10000, 20000, 30000, 40000, 50000 ]
+
+NOISE = [
+    ("tcp_open_total", 'tcp_open_total{direction="inbound",peer="src",target_addr="10.%d.%d.%d:4191",target_ip="10.%d.%d.%d",target_port="4191",tls="no_identity",no_tls_reason="no_authority_in_http_request",srv_kind="default",srv_name="all-unauthenticated"} %d'),
+    ("tcp_read_bytes_total", 'tcp_read_bytes_total{direction="inbound",peer="src",target_addr="10.%d.%d.%d:4191",target_ip="10.%d.%d.%d",target_port="4191",tls="no_identity",no_tls_reason="no_authority_in_http_request",srv_kind="default",srv_name="all-unauthenticated"} %d'),
+    ("tcp_write_bytes_total", 'tcp_write_bytes_total{direction="inbound",peer="src",target_addr="10.%d.%d.%d:4191",target_ip="10.%d.%d.%d",target_port="4191",tls="no_identity",no_tls_reason="no_authority_in_http_request",srv_kind="default",srv_name="all-unauthenticated"} %d'),
+    ("inbound_http_authz_allow_total", 'inbound_http_authz_allow_total{target_addr="10.%d.%d.%d:8000",target_ip="10.%d.%d.%d",target_port="8000",srv_group="policy.linkerd.io",srv_kind="server",srv_name="face",route_group="",route_kind="default",route_name="default",authz_group="policy.linkerd.io",authz_kind="authorizationpolicy",authz_name="face"} %d'),
+]
+
+
+def zone_names(zones):
+    return [ f"zone-{chr(ord('a') + i)}" if i < 26 else f"zone-{i}" for i in range(zones) ]
+
+
+def pod_names(workload, zones, pods):
+    """pods pods of workload, spread round-robin across the zones."""
+
+    names = zone_names(zones)
+
+    return [ (f"{workload}-{names[i % zones]}-5f98568cc-{i:05x}", names[i % zones])
+             for i in range(pods) ]
+
+
+def latency_cdf(ms, median, spread):
+    # Log-normal latencies are a decent stand-in for real request latency.
+    return 0.5 * (1 + math.erf((math.log(ms) - math.log(median)) / (spread * math.sqrt(2))))
+
+
+class Counter:
+    """Counter values for a tick: each series gets its own steady rate."""
+
+    def __init__(self, rng, tick, interval=5):
+        self.rng = rng
+        self.elapsed = (tick + 1) * interval
+
+    def __call__(self, rate=None):
+        if rate is None:
+            rate = self.rng.uniform(0.5, 20)
+
+        return int(rate * self.elapsed)
+
+
+def family(name, kind, help_text):
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} {kind}"
+
+
+def generate(zones=3, pods=6, routes=4, series=0, error_rate=0.05, tick=0, seed=1):
+    """Yield the lines of one dump. pods is per workload; series, if it's
+    more than the interesting series add up to, is filled with noise."""
+
+    rng = random.Random(seed)
+    count = Counter(rng, tick)
+    emitted = 0
+
+    # request_total and latency per destination pod.
+    all_pods = [ (workload, pod, zone) for workload in WORKLOADS
+                 for pod, zone in pod_names(workload, zones, pods) ]
+    pod_rates = [ rng.uniform(1, 50) for _ in all_pods ]
+
+    yield from family("request_total", "counter", "Total count of HTTP requests.")
+
+    for (workload, pod, zone), rate in zip(all_pods, pod_rates):
+        yield (f'request_total{{direction="outbound",authority="{workload}.faces.svc.cluster.local",'
+               f'target_addr="10.42.1.10:8000",target_ip="10.42.1.10",target_port="8000",tls="true",'
+               f'server_id="default.faces.serviceaccount.identity.linkerd.cluster.local",'
+               f'dst_control_plane_ns="linkerd",dst_deployment="{pod.rsplit("-", 2)[0]}",'
+               f'dst_namespace="faces",dst_pod="{pod}",dst_pod_template_hash="5f98568cc",'
+               f'dst_service="{workload}",dst_serviceaccount="default",dst_zone="{zone}"}} {count(rate)}')
+        emitted += 1
+
+    yield from family("response_latency_ms", "histogram", "Elapsed times between a request's headers being received and its response stream completing")
+
+    for (workload, pod, zone), rate in zip(all_pods, pod_rates):
+        labels = (f'direction="outbound",authority="{workload}.faces.svc.cluster.local",'
+                  f'tls="true",dst_namespace="faces",dst_pod="{pod}",dst_service="{workload}",'
+                  f'dst_zone="{zone}",status_code="200"')
+        total = count(rate)
+        median = rng.uniform(5, 60)
+
+        for le in LATENCY_BUCKETS:
+            yield f'response_latency_ms_bucket{{{labels},le="{le}"}} {int(total * latency_cdf(le, median, 0.8))}'
+
+        yield f'response_latency_ms_bucket{{{labels},le="+Inf"}} {total}'
+        yield f'response_latency_ms_sum{{{labels}}} {int(total * median * 1.4)}'
+        yield f'response_latency_ms_count{{{labels}}} {total}'
+        emitted += len(LATENCY_BUCKETS) + 3
+
+    # HAZL load per parent Service.
+    for which in [ "average", "band_low", "band_high" ]:
+        name = f"outbound_http_balancer_adaptive_load_{which}"
+        yield from family(name, "gauge", "HAZL load.")
+
+        for workload in WORKLOADS:
+            load = { "average": rng.uniform(0.5, 3), "band_low": 0.8, "band_high": 2.0 }[which]
+            yield (f'{name}{{parent_group="core",parent_kind="Service",parent_namespace="faces",'
+                   f'parent_name="{workload}",parent_port="80",parent_section_name="",'
+                   f'backend_group="core",backend_kind="Service",backend_namespace="faces",'
+                   f'backend_name="{workload}",backend_port="80",backend_section_name=""}} {load}')
+            emitted += 1
+
+    # Route statuses, HTTP and gRPC, with some errors mixed in.
+    for protocol, statuses, status_label, port, hostname in [
+        ("http", HTTP_STATUSES, "http_status", "80", "smiley"),
+        ("grpc", GRPC_STATUSES, "grpc_status", "8000", "color"),
+    ]:
+        name = f"outbound_{protocol}_route_request_statuses_total"
+        yield from family(name, "counter", "Completed request-response streams.")
+
+        for route in range(routes):
+            for i, (status, error) in enumerate(statuses):
+                rate = rng.uniform(5, 50) if i == 0 else rng.uniform(0, 50) * error_rate
+
+                yield (f'{name}{{parent_group="policy.linkerd.io",parent_kind="EgressNetwork",'
+                       f'parent_namespace="linkerd-egress",parent_name="all-egress",parent_port="{port}",'
+                       f'parent_section_name="",route_group="gateway.networking.k8s.io",'
+                       f'route_kind="{protocol.upper()}Route",route_namespace="faces",'
+                       f'route_name="route-{route}",hostname="{hostname}",'
+                       f'{status_label}="{status}",error="{error}"}} {count(rate)}')
+                emitted += 1
+
+        name = f"outbound_{protocol}_route_backend_requests_total"
+        yield from family(name, "counter", "The total number of requests dispatched to a backend.")
+
+        for route in range(routes):
+            for workload in WORKLOADS:
+                for backend in [ workload, f"{workload}-east", f"{workload}-west" ]:
+                    yield (f'{name}{{parent_group="core",parent_kind="Service",parent_namespace="faces",'
+                           f'parent_name="{workload}",parent_port="{port}",parent_section_name="",'
+                           f'route_group="gateway.networking.k8s.io",route_kind="{protocol.upper()}Route",'
+                           f'route_namespace="faces",route_name="route-{route}",backend_group="core",'
+                           f'backend_kind="Service",backend_namespace="faces",backend_name="{backend}",'
+                           f'backend_port="{port}",backend_section_name=""}} {count()}')
+                    emitted += 1
+
+    # And noise, most of what a busy proxy exports, to make up the rest.
+    noise = max(0, series - emitted)
+
+    for n, (name, template) in enumerate(NOISE):
+        share = noise // len(NOISE) + (1 if n < noise % len(NOISE) else 0)
+
+        if share == 0:
+            continue
+
+        yield from family(name, "counter", "Noise.")
+
+        for i in range(share):
+            a, b, c = (i >> 16) & 255, (i >> 8) & 255, i & 255
+            yield template % (a, b, c, a, b, c, count())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic proxy metrics dump')
+    parser.add_argument('--zones', type=int, default=3, help='Number of zones')
+    parser.add_argument('--pods', type=int, default=6, help='Pods per destination workload')
+    parser.add_argument('--routes', type=int, default=4, help='Routes per protocol')
+    parser.add_argument('--series', type=int, default=0, help='Pad with noise up to this many series')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='Share of traffic that fails')
+    parser.add_argument('--tick', type=int, default=0, help='Which scrape in a sequence this is')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    out = sys.stdout
+
+    for line in generate(zones=args.zones, pods=args.pods, routes=args.routes,
+                         series=args.series, error_rate=args.error_rate,
+                         tick=args.tick, seed=args.seed):
+        out.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Latency percentiles from the proxy's response_latency_ms histograms. A
+# histogram is a set of cumulative `_bucket` counters, one per upper bound
+# (the `le` label), so the same tricks as rates.py apply: take per-tick
+# deltas of each bucket (allowing for resets), keep a fixed-size window of
+# them with running totals, and work out percentiles from the totals the
+# way Prometheus' histogram_quantile() does.
+#
+# Histograms are merged by group: every series (one client pod's view of
+# one destination pod, say) is diffed against its own last scrape, and its
+# deltas are added into whichever group it belongs to (the destination pod,
+# its zone, its workload...) so a proxy restarting only resets its own
+# contribution. Each group's window lives in flat arrays, one slot per
+# bucket per tick.
+
+import math
+
+from array import array
+
+from rates import counter_delta
+
+INF = float("inf")
+
+
+def bucket_bound(labels):
+    """The upper bound of a _bucket sample, from its le label."""
+
+    le = labels.get("le", "+Inf")
+
+    if le == "+Inf":
+        return INF
+
+    return float(le)
+
+
+def quantile(q, bounds, counts):
+    """Estimate the q quantile (0 < q < 1) from cumulative bucket counts,
+    interpolating linearly within the bucket it falls in, as Prometheus
+    does. Returns None if there were no observations."""
+
+    if not counts or counts[-1] <= 0:
+        return None
+
+    rank = q * counts[-1]
+    lower = 0.0
+    below = 0.0
+
+    for bound, count in zip(bounds, counts):
+        if count >= rank:
+            if bound == INF:
+                # Nothing to interpolate towards: the best we can say is
+                # "more than the highest finite bound".
+                return lower
+
+            if count == below:
+                return bound
+
+            return lower + (bound - lower) * (rank - below) / (count - below)
+
+        lower = bound
+        below = count
+
+    return lower
+
+
+class Group:
+    __slots__ = ("bounds", "index", "deltas", "totals", "pending",
+                 "window", "tick", "count", "seen")
+
+    def __init__(self, bounds, window, seen):
+        self.bounds = bounds
+        self.index = { bound: i for i, bound in enumerate(bounds) }
+        self.window = window
+        self.deltas = array("d", [0.0]) * (window * len(bounds))
+        self.totals = array("d", [0.0]) * len(bounds)
+        self.pending = array("d", [0.0]) * len(bounds)
+        self.tick = 0
+        self.count = 0
+        self.seen = seen
+
+    def add(self, counts):
+        for bound, delta in counts.items():
+            i = self.index.get(bound)
+
+            if i is not None:
+                self.pending[i] += delta
+
+    def push(self):
+        n = len(self.bounds)
+        base = self.tick * n
+
+        for i in range(n):
+            self.totals[i] += self.pending[i] - self.deltas[base + i]
+            self.deltas[base + i] = self.pending[i]
+            self.pending[i] = 0.0
+
+        self.tick += 1
+        self.count = min(self.count + 1, self.window)
+
+        if self.tick == self.window:
+            # As in rates.RingBuffer, recompute the totals once per trip
+            # around the window so that rounding errors can't pile up.
+            self.tick = 0
+
+            for i in range(n):
+                self.totals[i] = math.fsum(self.deltas[i::n])
+
+
+class HistogramWindows:
+    """Sliding-window histograms. Call update() for every bucket series
+    you scrape each tick, then advance() once at the end of the tick."""
+
+    def __init__(self, window=10, evict_after=60):
+        self.window = window
+        self.evict_after = evict_after
+        self.tick = 0
+        self.last = {}
+        self.groups = {}
+
+    def update(self, series, groups, counts):
+        """Record the current cumulative counts ({bound: count}) of one
+        series, and add how much they grew since last time to each of
+        groups. The first time we see a series, it just sets the
+        baseline."""
+
+        prev = self.last.get(series)
+        self.last[series] = (counts, self.tick)
+
+        if prev is None:
+            return
+
+        prev_counts = prev[0]
+
+        # If the +Inf bucket went down, the proxy restarted, so every
+        # bucket starts over from zero.
+        reset = counts.get(INF, 0) < prev_counts.get(INF, 0)
+
+        deltas = { bound: count if reset else counter_delta(prev_counts.get(bound, 0), count)
+                   for bound, count in counts.items() }
+
+        for key in groups:
+            group = self.groups.get(key)
+
+            if group is None:
+                bounds = tuple(sorted(counts.keys()))
+                group = self.groups[key] = Group(bounds, self.window, self.tick)
+
+            group.add(deltas)
+            group.seen = self.tick
+
+    def advance(self):
+        for group in self.groups.values():
+            group.push()
+
+        self.tick += 1
+
+        idle = [ key for key, group in self.groups.items()
+                 if self.tick - group.seen > self.evict_after ]
+
+        for key in idle:
+            del self.groups[key]
+
+        idle = [ key for key, (_, seen) in self.last.items()
+                 if self.tick - seen > self.evict_after ]
+
+        for key in idle:
+            del self.last[key]
+
+    def quantiles(self, key, qs=(0.5, 0.95, 0.99)):
+        """The given quantiles of group key over the window, or Nones if
+        there's nothing to go on."""
+
+        group = self.groups.get(key)
+
+        if group is None:
+            return [ None for q in qs ]
+
+        return [ quantile(q, group.bounds, group.totals) for q in qs ]
+
+    def __len__(self):
+        return len(self.groups)
+
+
+def format_latency(value):
+    """Format a latency in milliseconds to fit a five-character column."""
+
+    if value is None:
+        return "    -"
+
+    if value < 10:
+        return "%5.1f" % value
+
+    if value < 100000:
+        return "%5d" % value
+
+    return "%4ds" % (value / 1000)
@@ -0,0 +1,529 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Where proxy metrics come from. The workshop scripts used to fork
+# `linkerd diagnostics proxy-metrics` on every poll, which goes through a
+# fresh `kubectl port-forward` every time and costs hundreds of milliseconds
+# before a single byte of metrics shows up. A source here is anything with a
+# fetch() method that returns the text of a metrics dump (and, from the
+# Source base class, a samples() method that parses it):
+#
+# - CLISource does it the old way, forking the linkerd CLI each time.
+# - HTTPSource GETs a metrics URL over one keep-alive connection.
+# - PortForwardSource keeps a single `kubectl port-forward` to the proxy's
+#   admin port running, and scrapes :4191/metrics through it.
+# - FallbackSource tries one source and falls back to another on failure.
+#
+# PrometheusSource is the odd one out: rather than a whole dump, it asks a
+# Prometheus that already scrapes the proxies for the result of one
+# (usually aggregating) query, so only the aggregated series cross the wire.
+# It has no fetch(), only samples(), which returns them as proxymetrics
+# Samples.
+#
+# RecordingSource and ReplaySource save scrapes to a scrapearchive and play
+# them back, so the scripts can run without a cluster. To get the same rates
+# from a replay as from the real thing, time each scrape with the now() of
+# the source it came from, not the clock.
+#
+# make_source() builds the usual combinations from command-line arguments,
+# and list_pods() and friends find the pods to point them at.
+
+import json
+import queue
+import re
+import subprocess
+import threading
+import time
+import urllib.parse
+
+import http.client
+
+from collections import namedtuple
+
+from proxymetrics import Sample, iter_samples
+from scrapearchive import ArchiveReader, ArchiveWriter
+
+SOURCE_KINDS = [ "port-forward", "cli", "url" ]
+
+
+class SourceError(Exception):
+    pass
+
+
+class EndOfRecording(Exception):
+    """Raised by a ReplaySource that has run out of scrapes. It isn't a
+    SourceError, because it means the scripts should stop rather than try
+    again."""
+
+    pass
+
+
+class Source:
+    def samples(self, prefixes=None):
+        """Fetch a dump and parse it, keeping only the series whose names
+        start with one of prefixes (if given)."""
+
+        return iter_samples(self.fetch().splitlines(), prefixes=prefixes)
+
+    def now(self):
+        """The time to compute rates for the latest scrape with: normally
+        the monotonic clock. (A ReplaySource has a clock of its own.)"""
+
+        return time.monotonic()
+
+
+class CLISource(Source):
+    def __init__(self, namespace, resource, context=None, timeout=10):
+        self.cmd = [ "linkerd" ]
+
+        if context:
+            self.cmd.extend(["--context", context])
+
+        self.cmd.extend(["diagnostics", "proxy-metrics", "-n", namespace, resource])
+
+        self.timeout = timeout
+
+    def __str__(self):
+        return " ".join(self.cmd)
+
+    def fetch(self):
+        # The CLI goes through the API server too, so don't let a hung one
+        # hold up the caller for ever.
+        try:
+            return subprocess.check_output(self.cmd, text=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            raise SourceError(f"Timed out running linkerd: {self}")
+        except (subprocess.CalledProcessError, OSError) as e:
+            raise SourceError(f"Error running linkerd: {e}")
+
+    def close(self):
+        pass
+
+
+class HTTPSource(Source):
+    def __init__(self, url, timeout=10):
+        parsed = urllib.parse.urlsplit(url)
+
+        if parsed.scheme != "http" or not parsed.hostname:
+            raise SourceError(f"Unsupported metrics URL {url}")
+
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/metrics"
+
+        if parsed.query:
+            self.path += "?" + parsed.query
+
+        self.timeout = timeout
+        self.conn = None
+
+    def __str__(self):
+        return self.url
+
+    def fetch(self):
+        # A kept-alive connection can go stale between polls, so if the
+        # request fails on a reused connection, try once more on a new one.
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port,
+                                                       timeout=self.timeout)
+
+            try:
+                self.conn.request("GET", self.path)
+                response = self.conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                error = e
+                continue
+
+            if response.status != 200:
+                raise SourceError(f"Error fetching {self.url}: HTTP {response.status}")
+
+            return body.decode("utf-8", errors="replace")
+
+        raise SourceError(f"Error fetching {self.url}: {error}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+reForwarding = re.compile(r"Forwarding from 127\.0\.0\.1:(\d+)")
+
+
+class PortForwardSource(Source):
+    def __init__(self, namespace, resource, context=None, port=4191, timeout=10):
+        self.cmd = [ "kubectl" ]
+
+        if context:
+            self.cmd.extend(["--context", context])
+
+        # Asking for ":4191" lets kubectl pick a free local port, which it
+        # tells us about on its first line of output.
+        self.cmd.extend(["port-forward", "-n", namespace, resource, f":{port}"])
+
+        self.timeout = timeout
+        self.proc = None
+        self.http = None
+
+    def __str__(self):
+        return " ".join(self.cmd)
+
+    def start(self):
+        self.close()
+
+        try:
+            self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, text=True)
+        except OSError as e:
+            raise SourceError(f"Error running kubectl: {e}")
+
+        # kubectl can sit there for ever before saying where it's
+        # forwarding from (the pod is pending, the API server is down...),
+        # so wait for its first line in another thread, for at most
+        # self.timeout.
+        first = queue.Queue()
+        threading.Thread(target=self.drain, args=(self.proc.stdout, first), daemon=True).start()
+
+        try:
+            line = first.get(timeout=self.timeout)
+        except queue.Empty:
+            self.close()
+            raise SourceError(f"Timed out starting port-forward: {self}")
+
+        matches = reForwarding.search(line)
+
+        if not matches:
+            self.close()
+            raise SourceError(f"Error starting port-forward: {self}")
+
+        self.http = HTTPSource(f"http://127.0.0.1:{matches.group(1)}/metrics",
+                               timeout=self.timeout)
+
+    @staticmethod
+    def drain(stdout, first):
+        first.put(stdout.readline())
+
+        # kubectl logs a line for every connection it handles. Keep draining
+        # them so it never blocks on a full pipe.
+        stdout.read()
+
+    def fetch(self):
+        if (self.proc is None) or (self.proc.poll() is not None):
+            self.start()
+
+        try:
+            return self.http.fetch()
+        except SourceError:
+            # Maybe the pod went away underneath the port-forward. Start
+            # over next time.
+            self.close()
+            raise
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+
+                try:
+                    self.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.proc.kill()
+                    self.proc.wait()
+
+            self.proc = None
+
+
+class FallbackSource(Source):
+    """Fetch from primary, or from fallback if primary fails. While primary
+    keeps failing, wait longer and longer (doubling from backoff up to
+    max_backoff seconds) before trying it again, rather than starting a
+    fresh kubectl port-forward on every poll, say."""
+
+    def __init__(self, primary, fallback, backoff=5, max_backoff=60):
+        self.primary = primary
+        self.fallback = fallback
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.retry_at = 0
+
+    def __str__(self):
+        return f"{self.primary} (falling back to {self.fallback})"
+
+    def fetch(self):
+        if time.monotonic() >= self.retry_at:
+            try:
+                text = self.primary.fetch()
+                self.backoff = self.min_backoff
+                return text
+            except SourceError:
+                self.retry_at = time.monotonic() + self.backoff
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+
+        return self.fallback.fetch()
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+
+class PrometheusSource:
+    """Run one query against Prometheus on every poll. If pin names a label
+    (pod, say), only the series for one value of it are returned: the same
+    one as last time while it's still there, or else the first one. That's
+    what scraping through a port-forward to deploy/face gets you, and it
+    means a counter summed over the other labels never goes down just
+    because some other replica went away."""
+
+    def __init__(self, url, query, timeout=10, pin=None):
+        self.query = " ".join(query.split())
+        self.http = HTTPSource(url.rstrip("/") + "/api/v1/query?" +
+                               urllib.parse.urlencode({ "query": self.query }),
+                               timeout=timeout)
+        self.url = url
+        self.pin = pin
+        self.pinned = None
+
+    def __str__(self):
+        return f"{self.url} ({self.query})"
+
+    def now(self):
+        return time.monotonic()
+
+    def samples(self, prefixes=None):
+        try:
+            response = json.loads(self.http.fetch())
+        except ValueError as e:
+            raise SourceError(f"Error querying {self.url}: {e}")
+
+        if response.get("status") != "success":
+            raise SourceError(f"Error querying {self.url}: {response.get('error', 'unknown error')}")
+
+        samples = []
+
+        for entry in response["data"]["result"]:
+            labels = dict(entry["metric"])
+            name = labels.pop("__name__", "")
+            timestamp, value = entry["value"]
+
+            if prefixes and not name.startswith(tuple(prefixes)):
+                continue
+
+            # Prometheus gives times in float seconds, but Samples are in
+            # integer milliseconds, like the exposition format's.
+            samples.append(Sample(name, labels, float(value), int(round(float(timestamp) * 1000))))
+
+        if self.pin:
+            values = sorted({ sample.labels[self.pin] for sample in samples if self.pin in sample.labels })
+
+            if values and (self.pinned not in values):
+                self.pinned = values[0]
+
+            samples = [ sample for sample in samples if sample.labels.get(self.pin) == self.pinned ]
+
+        return samples
+
+    def close(self):
+        self.http.close()
+
+
+class RecordingSource(Source):
+    """Pass another source's scrapes through, appending each one to an
+    archive as it goes by."""
+
+    def __init__(self, source, writer, key):
+        self.source = source
+        self.writer = writer
+        self.key = key
+
+    def __str__(self):
+        return f"{self.source} (recording to {self.writer.path})"
+
+    def fetch(self):
+        text = self.source.fetch()
+        self.writer.append(self.key, text)
+        return text
+
+    def close(self):
+        self.source.close()
+
+
+class ReplaySource(Source):
+    """Play back the scrapes recorded for one key, one per fetch(), as
+    fast as they're asked for. Its now() is the time the latest of them was
+    recorded, so rates come out the same however fast the replay goes, and
+    each source keeps its own clock even if several of them are replaying
+    archives that don't line up."""
+
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key = key
+        self.records = reader.records_for(key)
+        self.index = 0
+        self.time = None
+
+    def __str__(self):
+        return f"{self.reader.path} ({self.key})"
+
+    def fetch(self):
+        if self.index >= len(self.records):
+            raise EndOfRecording(f"End of recording for {self.key}")
+
+        record = self.records[self.index]
+        text = self.reader.text(record)
+        self.index += 1
+        self.time = record.time
+
+        return text
+
+    def now(self):
+        if self.time is None:
+            return super().now()
+
+        return self.time
+
+    def close(self):
+        pass
+
+
+# Every source recording to (or replaying from) the same path shares one
+# writer (or reader).
+archives = {}
+archives_lock = threading.Lock()
+
+
+def open_archive(path, kind):
+    with archives_lock:
+        if (path, kind) not in archives:
+            archives[(path, kind)] = kind(path)
+
+        return archives[(path, kind)]
+
+
+def source_key(context, namespace, resource):
+    return "/".join([ context or "", namespace, resource ])
+
+
+def replay_sources(path):
+    """One ReplaySource for every key recorded in the archive at path."""
+
+    reader = open_archive(path, ArchiveReader)
+
+    return { key: ReplaySource(reader, key) for key in reader.keys() }
+
+
+def make_source(kind, namespace, resource, context=None, url=None, timeout=10,
+                record=None, replay=None):
+    key = source_key(context, namespace, resource)
+
+    if replay:
+        reader = open_archive(replay, ArchiveReader)
+        keys = reader.keys()
+
+        # A recording of a single source can stand in for any source.
+        if (key not in keys) and (len(keys) == 1):
+            key = keys[0]
+
+        return ReplaySource(reader, key)
+
+    if kind == "cli":
+        source = CLISource(namespace, resource, context=context, timeout=timeout)
+    elif kind == "url":
+        if not url:
+            raise SourceError("The url source needs a URL")
+
+        # Scripts that scrape several contexts or pods can use one URL
+        # template for all of them.
+        source = HTTPSource(url.format(context=context, namespace=namespace,
+                                       resource=resource),
+                            timeout=timeout)
+    elif kind == "port-forward":
+        source = FallbackSource(
+            PortForwardSource(namespace, resource, context=context, timeout=timeout),
+            CLISource(namespace, resource, context=context, timeout=timeout),
+        )
+    else:
+        raise SourceError(f"Unknown metrics source {kind}")
+
+    if record:
+        source = RecordingSource(source, open_archive(record, ArchiveWriter), key)
+
+    return source
+
+
+def add_source_arguments(parser):
+    parser.add_argument('--source', choices=SOURCE_KINDS, default="port-forward",
+                        help='Where to get proxy metrics (default: port-forward, falling back to the linkerd CLI)')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Metrics URL for --source url ({context}, {namespace} and {resource} are filled in)')
+    parser.add_argument('--record', type=str, default=None,
+                        help='Append every scrape to this archive')
+    parser.add_argument('--replay', type=str, default=None,
+                        help='Play scrapes back from this archive instead of using --source')
+
+
+Pod = namedtuple("Pod", ["namespace", "name", "node"])
+
+
+def kubectl_json(args, context=None):
+    cmd = [ "kubectl" ]
+
+    if context:
+        cmd.extend(["--context", context])
+
+    cmd.extend(args)
+    cmd.extend(["-o", "json"])
+
+    try:
+        return json.loads(subprocess.check_output(cmd, text=True))
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        raise SourceError(f"Error running kubectl: {e}")
+
+
+def workload_selector(namespace, workload, context=None):
+    """Turn a workload like deploy/face into the label selector for its
+    pods. Only matchLabels is supported."""
+
+    obj = kubectl_json(["get", "-n", namespace, workload], context=context)
+    match_labels = obj.get("spec", {}).get("selector", {}).get("matchLabels", {})
+
+    if not match_labels:
+        raise SourceError(f"{namespace}/{workload} has no matchLabels selector")
+
+    return ",".join(f"{k}={v}" for k, v in sorted(match_labels.items()))
+
+
+def list_pods(namespace, selector=None, context=None):
+    args = [ "get", "pods", "-n", namespace ]
+
+    if selector:
+        args.extend(["-l", selector])
+
+    pods = []
+
+    for item in kubectl_json(args, context=context).get("items", []):
+        if item.get("status", {}).get("phase") != "Running":
+            continue
+
+        pods.append(Pod(namespace, item["metadata"]["name"],
+                        item.get("spec", {}).get("nodeName", "")))
+
+    return pods
+
+
+def node_zones(context=None):
+    zones = {}
+
+    for item in kubectl_json(["get", "nodes"], context=context).get("items", []):
+        labels = item["metadata"].get("labels", {})
+        zones[item["metadata"]["name"]] = labels.get("topology.kubernetes.io/zone", "")
+
+    return zones
@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared parser for the Prometheus text exposition format, as produced by
+# `linkerd diagnostics proxy-metrics` (or by scraping a proxy's :4191/metrics
+# directly). The workshop scripts all used to carry their own parsers that
+# split label strings on `,` and `=`, which falls over as soon as a label
+# value contains a comma or an escaped quote. This one follows the spec:
+#
+# name{label="value",...} value [timestamp]
+#
+# where label values are double-quoted, and may contain `\\`, `\"` and `\n`
+# escapes.
+
+import re
+import sys
+
+from collections import namedtuple
+
+# timestamp is in integer milliseconds since the epoch, as in the exposition
+# format, or None if the line didn't have one.
+Sample = namedtuple("Sample", ["name", "labels", "value", "timestamp"])
+
+reLabel = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+
+ESCAPES = {
+    "\\\\": "\\",
+    "\\\"": "\"",
+    "\\n": "\n",
+}
+
+reEscape = re.compile(r'\\[\\"n]')
+
+
+def unescape(value):
+    if "\\" not in value:
+        return value
+
+    return reEscape.sub(lambda m: ESCAPES[m.group(0)], value)
+
+
+def parse_labels(label_str):
+    labels = {}
+
+    # Label keys repeat on every line of a dump, so intern them: that makes
+    # the dicts cheaper to build and the keys cheaper to compare.
+
+    if "\\" in label_str:
+        # Escapes mean a value might contain a quote, so do this the slow,
+        # careful way.
+        for match in reLabel.finditer(label_str):
+            labels[sys.intern(match.group(1))] = unescape(match.group(2))
+
+        return labels
+
+    # No escapes means no value can contain a `"`, so `",` can only ever be
+    # the end of a value -- even if the value itself has commas in it.
+    items = label_str.rstrip().rstrip(",").rstrip().split('",')
+
+    if items[-1].endswith('"'):
+        items[-1] = items[-1][:-1]
+
+    for item in items:
+        key, sep, value = item.partition("=")
+
+        if sep:
+            # Drop the opening quote; what's left is exactly the value.
+            labels[sys.intern(key.strip())] = value.lstrip()[1:]
+
+    return labels
+
+
+def parse_line(line):
+    """Parse a single sample line. Returns None for comments, blank lines,
+    and anything we can't make sense of."""
+
+    line = line.strip()
+
+    if not line or line.startswith("#"):
+        return None
+
+    brace = line.find("{")
+
+    if brace >= 0:
+        # The value and timestamp can't contain a `}`, so the last one on
+        # the line closes the label set even if a label value contains one.
+        close = line.rfind("}")
+
+        if close < brace:
+            return None
+
+        name = line[:brace].strip()
+        labels = parse_labels(line[brace + 1:close])
+        rest = line[close + 1:].split()
+    else:
+        fields = line.split()
+        name = fields[0]
+        labels = {}
+        rest = fields[1:]
+
+    if not rest:
+        return None
+
+    try:
+        value = float(rest[0])
+        timestamp = int(rest[1]) if len(rest) > 1 else None
+    except ValueError:
+        return None
+
+    return Sample(sys.intern(name), labels, value, timestamp)
+
+
+class ScanStats:
+    """How much work a scan did: lines looked at vs lines actually parsed."""
+
+    def __init__(self):
+        self.scanned = 0
+        self.parsed = 0
+
+    def __str__(self):
+        return f"{self.scanned} lines scanned, {self.parsed} parsed"
+
+
+def family_wanted(family, prefixes):
+    # A family is `request` or `request_total` for samples named
+    # `request_total`, so keep it if it could produce anything we want.
+    for prefix in prefixes:
+        if prefix.startswith(family) or family.startswith(prefix):
+            return True
+
+    return False
+
+
+# The sample names a family's `# TYPE` header covers: `request_total` is in
+# the `request` family, and histograms and summaries add the rest.
+FAMILY_SUFFIXES = ( "", "_total", "_bucket", "_sum", "_count", "_created" )
+
+
+def in_family(line, family):
+    """Whether a sample line belongs to family, going by its name alone."""
+
+    if not line.startswith(family):
+        return False
+
+    rest = line[len(family):]
+
+    for suffix in FAMILY_SUFFIXES:
+        if rest.startswith(suffix) and rest[len(suffix):len(suffix) + 1] in ( "{", " ", "\t" ):
+            return True
+
+    return False
+
+
+def iter_samples(lines, prefixes=None, stats=None):
+    """Stream Samples out of an iterable of lines. If prefixes is given, the
+    samples of unwanted metric families are skipped based on their `# TYPE`
+    headers, and lines whose metric name doesn't start with one of the
+    prefixes are skipped before doing any label work at all. (Untyped
+    samples after a skipped family are still checked on their own names.)
+    If stats is given, it's updated with how many lines were scanned and
+    parsed."""
+
+    if prefixes is not None:
+        prefixes = tuple(prefixes)
+
+    families = {}
+    family = None
+    keep = True
+    scanned = 0
+    parsed = 0
+
+    try:
+        for line in lines:
+            scanned += 1
+
+            if line.startswith("#"):
+                if prefixes is not None and line.startswith("# TYPE "):
+                    family = line[7:].split(None, 1)[0]
+                    keep = families.get(family)
+
+                    if keep is None:
+                        keep = families[family] = family_wanted(family, prefixes)
+
+                continue
+
+            if not keep and in_family(line, family):
+                continue
+
+            if prefixes is not None and not line.startswith(prefixes):
+                continue
+
+            parsed += 1
+            sample = parse_line(line)
+
+            if sample is not None:
+                yield sample
+    finally:
+        if stats is not None:
+            stats.scanned += scanned
+            stats.parsed += parsed
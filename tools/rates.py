@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Bounded-memory rate windows for the live metrics scripts. Each series keeps
+# a fixed-size ring buffer of its recent per-tick deltas with a running sum,
+# so adding a sample and reading the average are both O(1), and series that
+# haven't been seen for a while are evicted so that a long session with lots
+# of churning routes doesn't grow without bound.
+#
+# Deltas are counter-reset aware, the way Prometheus' rate() is: a counter
+# that goes down has been reset (usually because the proxy restarted), so the
+# increase is taken to be its whole current value. Rates use the real time
+# between scrapes, not the nominal polling interval.
+
+from array import array
+
+
+def counter_delta(prev, current):
+    """How much a counter increased from prev to current, allowing for
+    resets."""
+
+    if current < prev:
+        return current
+
+    return current - prev
+
+
+class RingBuffer:
+    """A fixed-size window of floats with a running sum."""
+
+    __slots__ = ("values", "size", "count", "index", "total")
+
+    def __init__(self, size):
+        self.values = array("d", [0.0]) * size
+        self.size = size
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+
+    def append(self, value):
+        if self.count == self.size:
+            self.total -= self.values[self.index]
+        else:
+            self.count += 1
+
+        self.values[self.index] = value
+        self.total += value
+        self.index += 1
+
+        if self.index == self.size:
+            # Once per trip around the buffer, recompute the sum from scratch
+            # so floating-point error can't pile up over a week-long run.
+            self.index = 0
+            self.total = sum(self.values)
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+
+        return self.total / self.count
+
+    def last(self):
+        if self.count == 0:
+            return None
+
+        return self.values[self.index - 1]
+
+    def __len__(self):
+        return self.count
+
+
+class Series:
+    __slots__ = ("last", "last_time", "deltas", "elapsed", "seen")
+
+    def __init__(self, last, last_time, size, seen):
+        self.last = last
+        self.last_time = last_time
+        self.deltas = RingBuffer(size)
+        self.elapsed = RingBuffer(size)
+        self.seen = seen
+
+
+class SeriesWindows:
+    """Per-series rate windows over counters. Call update() with each
+    series' current count and the time it was scraped once per tick, and
+    advance() at the end of the tick."""
+
+    def __init__(self, window=10, evict_after=60):
+        self.window = window
+        self.evict_after = evict_after
+        self.tick = 0
+        self.series = {}
+
+    def update(self, key, count, now):
+        """Record the current count for key, scraped at time now (in
+        seconds). Returns the per-second rate over the window, or None if
+        this is the first time we've seen key."""
+
+        series = self.series.get(key)
+
+        if series is None:
+            self.series[key] = Series(count, now, self.window, self.tick)
+            return None
+
+        series.deltas.append(counter_delta(series.last, count))
+        series.elapsed.append(now - series.last_time)
+        series.last = count
+        series.last_time = now
+        series.seen = self.tick
+
+        if series.elapsed.total <= 0:
+            return 0.0
+
+        return series.deltas.total / series.elapsed.total
+
+    def delta(self, key):
+        """The most recent increase recorded for key, or None if there
+        isn't one yet."""
+
+        series = self.series.get(key)
+
+        if series is None:
+            return None
+
+        return series.deltas.last()
+
+    def advance(self):
+        self.tick += 1
+
+        idle = [ key for key, series in self.series.items()
+                 if self.tick - series.seen > self.evict_after ]
+
+        for key in idle:
+            del self.series[key]
+
+    def __len__(self):
+        return len(self.series)
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Machine-readable output for the live metrics scripts: with --ndjson, each
+# tick becomes one JSON object on its own line of stdout instead of a
+# screenful of colored text, so other tools can consume it without
+# screen-scraping.
+#
+# Records go through a bounded queue to a writer thread, so a slow reader
+# on the other end of a pipe can't make memory grow. When the queue is
+# full, --ndjson-when-full decides what happens: "block" (the default)
+# holds up the polling loop until the reader catches up, and "drop" throws
+# away the oldest record instead and notes how many went missing in the
+# next one that gets written.
+#
+# While a RecordWriter is active, anything else printed goes to stderr, so
+# stdout carries nothing but records. NaNs and infinities (a rate over no
+# time, say) are written as null, since JSON has no way to spell them.
+#
+# If the reader goes away (`| head`), emit() raises BrokenPipeError, which
+# the scripts take as the end of the run.
+
+import sys
+
+import json
+import math
+import os
+import queue
+import threading
+
+WHEN_FULL = [ "block", "drop" ]
+
+
+def finite(value):
+    """value with any non-finite floats in it replaced by None."""
+
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+
+    if isinstance(value, dict):
+        return { key: finite(item) for key, item in value.items() }
+
+    if isinstance(value, (list, tuple)):
+        return [ finite(item) for item in value ]
+
+    return value
+
+
+class RecordWriter:
+    def __init__(self, size=100, when_full="block"):
+        self.out = sys.stdout
+        sys.stdout = sys.stderr
+
+        self.queue = queue.Queue(maxsize=size)
+        self.when_full = when_full
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.broken = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def emit(self, record):
+        if self.broken:
+            raise BrokenPipeError("NDJSON reader went away")
+
+        if self.when_full == "block":
+            while not self.broken:
+                try:
+                    self.queue.put(record, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+            raise BrokenPipeError("NDJSON reader went away")
+
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                pass
+
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+
+            if record is None:
+                try:
+                    self.out.flush()
+                except (BrokenPipeError, ValueError):
+                    pass
+
+                break
+
+            with self.lock:
+                if self.dropped:
+                    record["dropped"] = self.dropped
+                    self.dropped = 0
+
+            try:
+                self.out.write(json.dumps(finite(record), separators=(",", ":"),
+                                          allow_nan=False) + "\n")
+
+                # Only flush once we've caught up, so a backlog goes out in
+                # as few writes as possible.
+                if self.queue.empty():
+                    self.out.flush()
+            except BrokenPipeError:
+                # Point stdout at /dev/null, so that flushing it on the way
+                # out doesn't fail all over again.
+                try:
+                    devnull = os.open(os.devnull, os.O_WRONLY)
+                    os.dup2(devnull, self.out.fileno())
+                    os.close(devnull)
+                except (OSError, ValueError):
+                    pass
+
+                self.broken = True
+                break
+            except ValueError:
+                self.broken = True
+                break
+
+    def close(self, timeout=5):
+        """Write out whatever is still queued (for up to timeout seconds)
+        and give stdout back."""
+
+        if not self.broken:
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+
+            self.thread.join(timeout)
+
+        sys.stdout = self.out
+
+
+def add_record_arguments(parser):
+    parser.add_argument('--ndjson', action='store_true',
+                        help='Write one JSON record per refresh to stdout instead of drawing the screen')
+    parser.add_argument('--ndjson-buffer', type=int, default=100,
+                        help='How many records to buffer for a slow reader')
+    parser.add_argument('--ndjson-when-full', choices=WHEN_FULL, default="block",
+                        help='When the buffer is full, wait for the reader (block) or drop the oldest record (drop)')
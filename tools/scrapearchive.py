@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# An append-only archive of raw metrics scrapes, so that the metrics scripts
+# can be run (and benchmarked) again later without a cluster. Each scrape is
+# stored as one record:
+#
+#     {"time": 1735689600.0, "key": "east/faces/deploy/face", "size": 12345}\n
+#     <size bytes of zlib-compressed scrape text>
+#
+# The header line is plain JSON so that reading the index means reading
+# the headers and seeking past the bodies, without decompressing anything.
+# Records are only ever appended, and each one is flushed as it's written,
+# so a recording that gets killed part-way loses at most its last record
+# (which the reader ignores, and which a writer appending to the archive
+# later cuts off first, so that what it appends can still be read).
+
+import json
+import os
+import threading
+import time
+import zlib
+
+from collections import namedtuple
+
+Record = namedtuple("Record", ["time", "key", "offset", "size"])
+
+
+def scan(file):
+    """Read the headers of the complete records in an archive, from the
+    start. Returns them, and where the last one ends."""
+
+    file.seek(0)
+    length = os.fstat(file.fileno()).st_size
+    records = []
+    end = 0
+
+    while True:
+        line = file.readline()
+
+        if not line.endswith(b"\n"):
+            break
+
+        try:
+            header = json.loads(line)
+        except ValueError:
+            break
+
+        offset = file.tell()
+
+        if offset + header["size"] > length:
+            # The last record didn't get written out completely.
+            break
+
+        records.append(Record(header["time"], header["key"], offset, header["size"]))
+        end = offset + header["size"]
+        file.seek(end)
+
+    return records, end
+
+
+class ArchiveWriter:
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self.file = open(path, "ab")
+        self.lock = threading.Lock()
+
+        with open(path, "rb") as f:
+            _, end = scan(f)
+
+        if end < self.file.tell():
+            self.file.truncate(end)
+
+    def append(self, key, text, when=None):
+        body = zlib.compress(text.encode("utf-8"), self.level)
+        header = json.dumps({
+            "time": when if when is not None else time.time(),
+            "key": key,
+            "size": len(body),
+        })
+
+        with self.lock:
+            self.file.write(header.encode("utf-8") + b"\n" + body)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.lock = threading.Lock()
+        self.records, _ = scan(self.file)
+
+    def keys(self):
+        """The keys in the archive, in the order they first show up."""
+
+        return list(dict.fromkeys(record.key for record in self.records))
+
+    def records_for(self, key):
+        return [ record for record in self.records if record.key == key ]
+
+    def text(self, record):
+        with self.lock:
+            self.file.seek(record.offset)
+            body = self.file.read(record.size)
+
+        return zlib.decompress(body).decode("utf-8")
+
+    def close(self):
+        self.file.close()
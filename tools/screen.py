@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# Screen output for the live metrics scripts. They used to run `clear` (or
+# `os.system("clear")` and `os.system("date")`) before every refresh, which
+# forks a process or two per tick and makes the whole screen flicker. Here,
+# a script just prints each frame as usual inside a frame() block:
+#
+#     screen = make_screen(args.screen)
+#
+#     while True:
+#         with screen.frame():
+#             print(...)
+#
+# and the screen works out what to send:
+#
+# - ANSIScreen compares the frame with the last one and rewrites only the
+#   lines that changed, using cursor addressing.
+# - CursesScreen hands the frame to curses, which does the same thing
+#   cell by cell and copes well with slow links.
+# - PlainScreen just prints every frame, for when stdout isn't a terminal.
+#
+# While an ANSI or curses screen is active it owns stdout, so anything
+# printed outside a frame (an error message, say) goes to stderr instead.
+# Anything written to stderr lands on the terminal too, so the next frame
+# is drawn from scratch over whatever it left behind.
+
+import sys
+
+import contextlib
+import io
+import re
+import shutil
+
+SCREEN_KINDS = [ "ansi", "curses", "plain" ]
+
+reSGR = re.compile(r"\033\[([0-9;]*)m")
+
+
+class PlainScreen:
+    def __init__(self):
+        self.out = sys.stdout
+
+    @contextlib.contextmanager
+    def frame(self):
+        yield
+        self.out.flush()
+
+    def close(self):
+        pass
+
+
+class StrayOutput(io.TextIOBase):
+    """Stands in for stderr, and for stdout between frames: writes go to the
+    real stderr, and mark the screen as needing a full redraw."""
+
+    def __init__(self, screen, stream):
+        self.screen = screen
+        self.stream = stream
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.screen.dirty = True
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class CapturingScreen:
+    """Base for screens that collect each frame and then draw it."""
+
+    def __init__(self):
+        self.out = sys.stdout
+        self.err = sys.stderr
+        self.dirty = False
+        self.stray = StrayOutput(self, self.err)
+        sys.stdout = self.stray
+        sys.stderr = self.stray
+
+    @contextlib.contextmanager
+    def frame(self):
+        buffer = io.StringIO()
+        sys.stdout = buffer
+
+        try:
+            yield
+        finally:
+            sys.stdout = self.stray
+
+        self.draw(buffer.getvalue().rstrip("\n").split("\n"))
+
+    def close(self):
+        sys.stdout = self.out
+        sys.stderr = self.err
+
+
+class ANSIScreen(CapturingScreen):
+    def __init__(self):
+        super().__init__()
+        self.lines = None
+        self.size = None
+
+    def draw(self, lines):
+        # shutil falls back to $COLUMNS/$LINES or 80x24 when stdout isn't
+        # a terminal (--screen ansi into a pipe, say).
+        size = shutil.get_terminal_size()
+        lines = lines[:size.lines]
+
+        # Turn off line wrapping while drawing, so that a long line can't
+        # push everything below it down a row.
+        output = [ "\033[?7l" ]
+
+        if (self.lines is None) or (size != self.size) or self.dirty:
+            # First frame, the terminal changed size, or something else
+            # wrote to it: start over.
+            output.append("\033[H\033[2J")
+            self.lines = []
+            self.size = size
+            self.dirty = False
+
+        for row, line in enumerate(lines):
+            if (row < len(self.lines)) and (self.lines[row] == line):
+                continue
+
+            output.append(f"\033[{row + 1};1H{line}\033[0m\033[K")
+
+        # Park the cursor below the frame and clear whatever is left there
+        # from a longer frame.
+        if len(lines) < size.lines:
+            output.append(f"\033[{len(lines) + 1};1H\033[J")
+
+        output.append("\033[?7h")
+
+        self.lines = lines
+        self.out.write("".join(output))
+        self.out.flush()
+
+    def close(self):
+        super().close()
+
+        if self.lines is not None:
+            self.out.write("\033[?7h\n")
+            self.out.flush()
+
+
+class CursesScreen(CapturingScreen):
+    # The colors the scripts use, by SGR code. The bright ones (91 and 92)
+    # are drawn bold in the same colors.
+    COLORS = {
+        "31": 1,    # red
+        "32": 2,    # green
+    }
+
+    BRIGHT = {
+        "91": "31",
+        "92": "32",
+    }
+
+    def __init__(self):
+        import curses
+
+        self.curses = curses
+        self.window = curses.initscr()
+        curses.noecho()
+        curses.curs_set(0)
+
+        self.attributes = {}
+
+        if curses.has_colors():
+            curses.start_color()
+            curses.use_default_colors()
+
+            for code, color in [ ("31", curses.COLOR_RED), ("32", curses.COLOR_GREEN) ]:
+                curses.init_pair(self.COLORS[code], color, -1)
+                self.attributes[code] = curses.color_pair(self.COLORS[code])
+
+        for code, base in self.BRIGHT.items():
+            self.attributes[code] = self.attributes.get(base, 0) | curses.A_BOLD
+
+        # Not every terminal has a grey, but dim is close enough.
+        self.attributes["90"] = curses.A_DIM
+
+        super().__init__()
+
+    def draw(self, lines):
+        height, width = self.window.getmaxyx()
+
+        if self.dirty:
+            # Repaint every cell, not just the ones curses thinks changed.
+            self.window.clear()
+            self.dirty = False
+        else:
+            self.window.erase()
+
+        for row, line in enumerate(lines[:height]):
+            attribute = 0
+            column = 0
+
+            # Split the line into runs of text between SGR escapes, and
+            # draw each run with the attribute in effect.
+            for i, part in enumerate(reSGR.split(line)):
+                if i % 2 == 1:
+                    codes = part.split(";")[-1]
+                    attribute = self.attributes.get(codes, 0)
+                    continue
+
+                if (not part) or (column >= width):
+                    continue
+
+                try:
+                    self.window.addstr(row, column, part[:width - column], attribute)
+                except self.curses.error:
+                    # Writing the bottom-right cell "fails" after it works.
+                    pass
+
+                column += len(part)
+
+        self.window.refresh()
+
+    def close(self):
+        self.curses.endwin()
+        super().close()
+
+
+def make_screen(kind=None):
+    if kind is None:
+        kind = "ansi" if sys.stdout.isatty() else "plain"
+
+    if kind == "curses":
+        return CursesScreen()
+    elif kind == "ansi":
+        return ANSIScreen()
+
+    return PlainScreen()
+
+
+def add_screen_arguments(parser):
+    parser.add_argument('--screen', choices=SCREEN_KINDS, default=None,
+                        help='How to redraw the screen (default: ansi on a terminal, otherwise plain)')
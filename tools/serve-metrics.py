@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# SPDX-FileCopyrightText: 2025 Buoyant Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+# A tiny stand-in for a proxy's admin port: serve recorded metrics dumps at
+# /metrics, moving on to the next dump with each request (and sticking on the
+# last one). Point the metrics scripts at it with
+#
+# python serve-metrics.py --port 4191 dump1.txt dump2.txt ...
+# python zone-metrics.py --source url --url http://localhost:4191/metrics
+
+import sys
+
+import argparse
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Dumps:
+    def __init__(self, paths):
+        self.bodies = [ open(path, "rb").read() for path in paths ]
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            body = self.bodies[self.index]
+
+            if self.index < len(self.bodies) - 1:
+                self.index += 1
+
+            return body
+
+
+def make_handler(dumps):
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so that clients can keep their connections alive.
+        protocol_version = "HTTP/1.1"
+
+        # Headers and body go out in separate writes; without TCP_NODELAY,
+        # Nagle and delayed ACKs add ~40ms to every kept-alive request.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body = dumps.next()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded proxy metrics dumps')
+    parser.add_argument('--port', type=int, default=4191, help='Port to listen on')
+    parser.add_argument('dumps', nargs='+', help='Metrics dump files to serve, in order')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(Dumps(args.dumps)))
+    print(f"Serving {len(args.dumps)} dump(s) at http://127.0.0.1:{server.server_port}/metrics")
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()